@@ -0,0 +1,59 @@
+"""
+Compare `df_to_dict` with the row-by-row eval/exec implementation it replaced.
+
+    python benchmarks/bench_df_to_dict.py --fanout 20
+"""
+
+import functools
+import operator
+import timeit
+
+import click
+import pandas as pd
+
+from excelcreator.utils import NestedDict, df_to_dict, get_groups, get_scenarios
+from synthetic import make_df
+
+
+def legacy_df_to_dict(in_df: pd.DataFrame) -> NestedDict:
+    """
+    The original `df_to_dict`, kept here as the baseline.
+    """
+    big_dict = NestedDict()
+    groupnames = get_groups(in_df)
+    scenarionames = get_scenarios(in_df)
+    for i, row in in_df.iterrows():
+        dim_name = row.Mode
+        scenario_data = row[scenarionames].to_list()
+        upd_d = {dim_name: scenario_data}
+
+        gbrackets = [f"[row[{group!r}]]" for group in groupnames]
+        dict_accessor = "big_dict" + functools.reduce(operator.concat, gbrackets[:-1])
+        ex_d = eval(dict_accessor)
+        new_d = {**ex_d, **upd_d}
+        dict_set = dict_accessor + " = new_d"
+        exec(dict_set)
+
+    return big_dict
+
+
+@click.command()
+@click.option("--sheets", default=10)
+@click.option("--depth", default=2)
+@click.option("--fanout", default=10)
+@click.option("--modes", default=4)
+@click.option("--scenarios", default=6)
+@click.option("--repeat", default=3)
+def main(sheets, depth, fanout, modes, scenarios, repeat) -> None:
+    df = make_df(sheets, depth, fanout, modes, scenarios)
+    assert df_to_dict(df) == legacy_df_to_dict(df), "outputs differ"
+
+    legacy = min(timeit.repeat(lambda: legacy_df_to_dict(df), number=1, repeat=repeat))
+    new = min(timeit.repeat(lambda: df_to_dict(df), number=1, repeat=repeat))
+    click.echo(f"{len(df):,} rows")
+    click.echo(f"legacy df_to_dict: {legacy:.3f}s")
+    click.echo(f"df_to_dict:        {new:.3f}s ({legacy / new:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compare the engines of `createxl --engine`: time and peak memory to convert the same
+synthetic CSV, or with --no-write only to read it and lay out its sheets (where the
+engines differ). Each run is in a fresh process, so its peak RSS (and its imports) are
+its own.
+
+    python benchmarks/bench_engines.py --rows 500000 --streaming
+    python benchmarks/bench_engines.py --rows 2000000 --no-write
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import click
+
+from synthetic import make_df
+
+ENGINES = ["pandas", "csv", "polars"]
+
+
+def prepare_all(engine: str, csv_path: str) -> None:
+    """
+    Read `csv_path` and lay out every sheet, as `engine` does before writing.
+    """
+    from excelcreator.writer import ROW_OFFSET
+
+    if engine == "csv":
+        from excelcreator.csv_engine import prepare_csv_sheets, read_csv_sheets
+
+        schema, sheets = read_csv_sheets(csv_path)
+        list(prepare_csv_sheets(sheets, ROW_OFFSET, schema))
+    elif engine == "polars":
+        from excelcreator.polars_engine import (
+            prepare_polars_sheets,
+            read_polars_sheets,
+        )
+
+        schema, sheets = read_polars_sheets(csv_path)
+        list(prepare_polars_sheets(sheets, ROW_OFFSET, schema))
+    else:
+        from excelcreator.creators import prepare_sheets
+        from excelcreator.schema import Schema
+        from excelcreator.utils import (
+            df_from_clargs,
+            normalize_columns,
+            partition_sheets,
+            shorten_long_sheetnames,
+        )
+
+        in_df = df_from_clargs(csv_path)
+        schema = Schema.from_columns(in_df.columns)
+        in_df = normalize_columns(shorten_long_sheetnames(in_df), schema)
+        list(prepare_sheets(partition_sheets(in_df, schema), ROW_OFFSET, schema))
+
+
+def convert(engine: str, csv_path: str, excel_path: str, streaming: bool) -> None:
+    if engine == "csv":
+        from excelcreator.csv_engine import create_xl_from_csv
+
+        create_xl_from_csv(csv_path, excel_path, streaming=streaming)
+    elif engine == "polars":
+        from excelcreator.polars_engine import create_xl_from_polars
+
+        create_xl_from_polars(csv_path, excel_path, streaming=streaming)
+    else:
+        from excelcreator.creators import create_xl_from_df
+        from excelcreator.utils import df_from_clargs
+
+        create_xl_from_df(df_from_clargs(csv_path), excel_path, streaming=streaming)
+
+
+def timed_run(engine: str, csv_path: str, excel_path: str, streaming, write, queue):
+    # everything is imported in here so the time and memory of the imports count too
+    from excelcreator.profiling import peak_rss_mb
+
+    start = time.perf_counter()
+    if write:
+        convert(engine, csv_path, excel_path, streaming)
+    else:
+        prepare_all(engine, csv_path)
+    queue.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+@click.command()
+@click.option("--sheets", default=10)
+@click.option("--depth", default=2)
+@click.option("--fanout", default=5)
+@click.option("--modes", default=4)
+@click.option("--scenarios", default=6)
+@click.option("--rows", type=int, default=None, help="Exact row count (sets --modes).")
+@click.option("--streaming", is_flag=True, default=False)
+@click.option(
+    "--write/--no-write",
+    default=True,
+    help="Write the workbook, or stop once every sheet is laid out.",
+)
+@click.option("--engine", "engines", multiple=True, type=click.Choice(ENGINES))
+def main(
+    sheets, depth, fanout, modes, scenarios, rows, streaming, write, engines
+) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        csv_path = os.path.join(folder, "input.csv")
+        df = make_df(sheets, depth, fanout, modes, scenarios, n_rows=rows)
+        df.to_csv(csv_path, index=False)
+        click.echo(f"{len(df):,} rows, {os.path.getsize(csv_path) / 2**20:.1f} MB CSV")
+        del df
+
+        for engine in engines or ENGINES:
+            excel_path = os.path.join(folder, f"{engine}.xlsx")
+            queue = ctx.Queue()
+            args = (engine, csv_path, excel_path, streaming, write, queue)
+            proc = ctx.Process(target=timed_run, args=args)
+            proc.start()
+            seconds, peak_mb = queue.get()
+            proc.join()
+            click.echo(f"{engine:<8} {seconds:8.2f}s  peak RSS {peak_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
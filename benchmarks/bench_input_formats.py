@@ -0,0 +1,90 @@
+"""
+Compare parse time and peak memory of `df_from_clargs` for each input format.
+Each read runs in a fresh process so its peak RSS isn't hidden by earlier reads.
+
+    python benchmarks/bench_input_formats.py --fanout 40
+"""
+
+import importlib
+import multiprocessing
+import os
+import tempfile
+import time
+
+import click
+
+from excelcreator.profiling import peak_rss_mb
+from excelcreator.utils import df_from_clargs
+from synthetic import make_df
+
+# (label, file extension, csv engine)
+CASES = [
+    ("csv (c)", ".csv", "c"),
+    ("csv (pyarrow)", ".csv", "pyarrow"),
+    ("parquet", ".parquet", "c"),
+    ("feather", ".feather", "c"),
+    ("arrow ipc", ".arrow", "c"),
+]
+
+# modules the readers above import on first use
+READER_MODULES = ("pyarrow.csv", "pyarrow.feather", "pyarrow.ipc", "pyarrow.parquet")
+
+
+def timed_read(path: str, csv_engine: str, queue) -> None:
+    # import every reader up front so the peak below only counts the read itself
+    for module in READER_MODULES:
+        importlib.import_module(module)
+
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    df = df_from_clargs(path, csv_engine=csv_engine)
+    seconds = time.perf_counter() - start
+    queue.put((seconds, peak_rss_mb() - baseline_mb, len(df)))
+
+
+def write_inputs(folder: str, **kwargs) -> None:
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    df = make_df(**kwargs)
+    df.to_csv(os.path.join(folder, "input.csv"), index=False)
+    df.to_parquet(os.path.join(folder, "input.parquet"), index=False)
+    df.to_feather(os.path.join(folder, "input.feather"))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_file(os.path.join(folder, "input.arrow"), table.schema) as writer:
+        writer.write_table(table)
+
+
+@click.command()
+@click.option("--sheets", default=10)
+@click.option("--depth", default=2)
+@click.option("--fanout", default=20)
+@click.option("--modes", default=10)
+@click.option("--scenarios", default=20)
+def main(sheets, depth, fanout, modes, scenarios) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        write_inputs(
+            folder,
+            n_sheets=sheets,
+            depth=depth,
+            fanout=fanout,
+            n_modes=modes,
+            n_scenarios=scenarios,
+        )
+        for label, ext, csv_engine in CASES:
+            path = os.path.join(folder, "input" + ext)
+            queue = ctx.Queue()
+            proc = ctx.Process(target=timed_read, args=(path, csv_engine, queue))
+            proc.start()
+            seconds, peak_mb, n_rows = queue.get()
+            proc.join()
+            size_mb = os.path.getsize(path) / 2**20
+            click.echo(
+                f"{label:<14} {size_mb:7.1f} MB on disk  {seconds:6.3f}s  "
+                f"peak RSS +{peak_mb:6.1f} MB  ({n_rows:,} rows)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Time each stage of a conversion, and measure its peak memory, on a seeded synthetic
+input. Results can be saved as JSON and compared with those of another commit.
+
+    python benchmarks/bench_stages.py --rows 200000 -o before.json
+    python benchmarks/bench_stages.py --rows 200000 --compare before.json
+"""
+
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import click
+import pandas as pd
+import xlsxwriter
+
+from excelcreator.layout import layout_sheet
+from excelcreator.schema import Schema
+from excelcreator.utils import (
+    df_from_clargs,
+    df_to_dict,
+    normalize_columns,
+    partition_sheets,
+    shorten_long_sheetnames,
+)
+from excelcreator.writer import create_format_dict, write_sheet
+from synthetic import make_df
+
+
+class StageRecorder:
+    """
+    Context manager factory recording the wall and CPU time of each stage, and its peak
+    traced memory if `trace_memory` (tracing slows everything down, so the two are
+    measured in separate runs).
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        result = self.results.setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0})
+        result["seconds"] += time.perf_counter() - wall
+        result["cpu_seconds"] += time.process_time() - cpu
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak_mb = (peak - before) / 2**20
+            result["peak_mb"] = max(result.get("peak_mb", 0.0), peak_mb)
+
+
+def run_stages(
+    csv_path: str, excel_path: str, stage, streaming: bool, formula_mode: str
+) -> None:
+    """
+    The steps of `create_xl_from_df` (single process, no cache), each under `stage`.
+    Sheets are laid out and written one at a time as in the real thing, so the per-sheet
+    stages add up over all sheets.
+    """
+    with stage("df_from_clargs"):
+        in_df = df_from_clargs(csv_path)
+
+    workbook = xlsxwriter.Workbook(excel_path, {"constant_memory": streaming})
+    index_sheet = workbook.add_worksheet("Index")
+    schema = Schema.from_columns(in_df.columns)
+    format_dict = create_format_dict(workbook, len(schema.groupnames))
+
+    with stage("shorten_long_sheetnames"):
+        in_df = shorten_long_sheetnames(in_df)
+    with stage("normalize_columns"):
+        in_df = normalize_columns(in_df, schema)
+    with stage("partition_sheets"):
+        sheet_dfs = partition_sheets(in_df, schema)
+
+    index_row_offset = 0
+    for sheetname, sheet_df in sheet_dfs.items():
+        with stage("df_to_dict"):
+            scenarionames = schema.nonempty_scenarios(sheet_df)
+            sheet_dict = df_to_dict(sheet_df, schema, scenarionames)
+        with stage("layout_sheet"):
+            plan = layout_sheet(sheet_dict, 3, len(scenarionames))
+        # mostly `create_data_rows`, plus the fixed-size header and index entries
+        with stage("create_data_rows"):
+            index_row_offset = write_sheet(
+                workbook,
+                sheetname,
+                scenarionames,
+                plan,
+                format_dict,
+                index_sheet,
+                index_row_offset,
+                formula_mode,
+            )
+
+    with stage("workbook.close"):
+        workbook.close()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(report: dict, previous: dict | None = None) -> None:
+    click.echo(f"{report['rows']:,} rows, {report['sheets']} sheets")
+    old_stages = previous["stages"] if previous else {}
+    for name, result in report["stages"].items():
+        line = f"{name:<24} {result['seconds']:8.3f}s"
+        if "peak_mb" in result:
+            line += f"  peak +{result['peak_mb']:8.1f} MB"
+        old = old_stages.get(name)
+        if old and old["seconds"] > 0:
+            ratio = result["seconds"] / old["seconds"]
+            line += f"  ({ratio:5.2f}x of {old['seconds']:.3f}s"
+            if "peak_mb" in result and "peak_mb" in old:
+                line += f", {old['peak_mb']:.1f} MB"
+            line += f" at {previous.get('commit') or '?'})"
+        click.echo(line)
+
+
+@click.command()
+@click.option("--sheets", default=10)
+@click.option("--depth", default=2)
+@click.option("--fanout", default=5)
+@click.option("--modes", default=4)
+@click.option("--scenarios", default=6)
+@click.option("--rows", type=int, default=None, help="Exact row count (sets --modes).")
+@click.option("--seed", default=0)
+@click.option("--streaming", is_flag=True, default=False)
+@click.option("--formulas", type=click.Choice(["offset", "index"]), default="offset")
+@click.option("--repeat", default=1, help="Timing runs; the fastest of each is kept.")
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    help="Also measure peak memory per stage, in an extra run under tracemalloc.",
+)
+@click.option("--output", "-o", "output_path", help="Save the results as JSON.")
+@click.option(
+    "--compare",
+    "compare_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON results of an earlier run to compare with.",
+)
+def main(
+    sheets,
+    depth,
+    fanout,
+    modes,
+    scenarios,
+    rows,
+    seed,
+    streaming,
+    formulas,
+    repeat,
+    memory,
+    output_path,
+    compare_path,
+) -> None:
+    config = {
+        "sheets": sheets,
+        "depth": depth,
+        "fanout": fanout,
+        "modes": modes,
+        "scenarios": scenarios,
+        "rows": rows,
+        "seed": seed,
+        "streaming": streaming,
+        "formulas": formulas,
+    }
+    df = make_df(sheets, depth, fanout, modes, scenarios, seed, rows)
+
+    with tempfile.TemporaryDirectory() as folder:
+        csv_path = os.path.join(folder, "input.csv")
+        excel_path = os.path.join(folder, "output.xlsx")
+        df.to_csv(csv_path, index=False)
+
+        stages = {}
+        for _ in range(repeat):
+            recorder = StageRecorder()
+            run_stages(csv_path, excel_path, recorder, streaming, formulas)
+            for name, result in recorder.results.items():
+                if name not in stages or result["seconds"] < stages[name]["seconds"]:
+                    stages[name] = result
+        output_mb = os.path.getsize(excel_path) / 2**20
+
+        if memory:
+            recorder = StageRecorder(trace_memory=True)
+            tracemalloc.start()
+            try:
+                run_stages(csv_path, excel_path, recorder, streaming, formulas)
+            finally:
+                tracemalloc.stop()
+            for name, result in recorder.results.items():
+                stages[name]["peak_mb"] = result["peak_mb"]
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "xlsxwriter": xlsxwriter.__version__,
+        "config": config,
+        "rows": len(df),
+        "sheets": df.iloc[:, 0].nunique(),
+        "output_mb": output_mb,
+        "total_seconds": sum(result["seconds"] for result in stages.values()),
+        "stages": stages,
+    }
+
+    previous = None
+    if compare_path is not None:
+        with open(compare_path) as f:
+            previous = json.load(f)
+        if previous.get("config") != config:
+            click.echo(f"warning: {compare_path} was run with a different config")
+    print_results(report, previous)
+    click.echo(f"{'total':<24} {report['total_seconds']:8.3f}s")
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"results saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Measure how long the command line tools take to start: import times from
+`python -X importtime`, and the wall time of `createxl --help` and of a run that stops
+at argument checking. Heavy libraries imported at startup are listed.
+
+    python benchmarks/bench_startup.py -o startup.json
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+import click
+
+# imports that a run which never converts anything shouldn't pay for
+HEAVY_MODULES = ("pandas", "numpy", "xlsxwriter", "pyarrow", "polars")
+
+# the engine that mustn't import pandas, see `--engine csv`
+PANDAS_FREE_MODULE = "excelcreator.csv_engine"
+
+# (label, python -c code, arguments)
+COMMANDS = [
+    ("python (no imports)", "pass", []),
+    ("createxl --help", "from excelcreator.toexcel import run; run()", ["--help"]),
+    (
+        "createxl bad output folder",
+        "from excelcreator.toexcel import run; run()",
+        ["input.csv", "-o", "not/a/folder"],
+    ),
+    (
+        "createxl-batch --help",
+        "from excelcreator.toexcel import batch; batch()",
+        ["--help"],
+    ),
+    (
+        "createxl-serve --help",
+        "from excelcreator.toexcel import serve; serve()",
+        ["--help"],
+    ),
+]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """
+    Cumulative import time (microseconds) of every module imported by `module`, as
+    reported by `python -X importtime`.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def heavy_imports(times: dict[str, int]) -> list[str]:
+    """
+    The `HEAVY_MODULES` among the modules in `times`.
+    """
+    return sorted({name.split(".")[0] for name in times} & set(HEAVY_MODULES))
+
+
+def wall_time(code: str, args: list[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code, *args], capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--module", default="excelcreator.toexcel", help="Module to import.")
+@click.option("--repeat", default=5, help="Runs of each command; the fastest is kept.")
+@click.option("--top", default=10, help="Number of slowest imports listed.")
+@click.option("--output", "-o", "output_path", help="Save the results as JSON.")
+def main(module, repeat, top, output_path) -> None:
+    times = import_times(module)
+    heavy_roots = heavy_imports(times)
+
+    click.echo(f"import {module}: {times[module] / 1000:.1f} ms")
+    others = {name: t for name, t in times.items() if name != module}
+    for name, t in sorted(others.items(), key=lambda item: -item[1])[:top]:
+        click.echo(f"  {name:<40} {t / 1000:8.1f} ms")
+    if heavy_roots:
+        click.echo(f"heavy modules imported: {', '.join(heavy_roots)}")
+    else:
+        click.echo("no heavy modules imported")
+
+    csv_engine_heavy = heavy_imports(import_times(PANDAS_FREE_MODULE))
+    click.echo(f"{PANDAS_FREE_MODULE} imports: {', '.join(csv_engine_heavy)}")
+    if "pandas" in csv_engine_heavy:
+        click.echo(f"warning: {PANDAS_FREE_MODULE} imports pandas")
+
+    commands = {}
+    for label, code, args in COMMANDS:
+        commands[label] = wall_time(code, args, repeat)
+        click.echo(f"{label:<28} {commands[label] * 1000:8.1f} ms")
+
+    if output_path is not None:
+        report = {
+            "python": sys.version.split()[0],
+            "module": module,
+            "import_ms": times[module] / 1000,
+            "heavy_modules": heavy_roots,
+            "csv_engine_heavy_modules": csv_engine_heavy,
+            "imports_ms": {name: t / 1000 for name, t in times.items()},
+            "commands_ms": {label: t * 1000 for label, t in commands.items()},
+        }
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"results saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
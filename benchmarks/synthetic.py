@@ -0,0 +1,69 @@
+"""
+Seeded synthetic inputs in the CSV layout described in the README.
+
+    python benchmarks/synthetic.py inputs/synthetic.csv --sheets 50 --rows 200000
+"""
+
+import math
+
+import click
+import numpy as np
+import pandas as pd
+
+
+def make_df(
+    n_sheets: int = 10,
+    depth: int = 2,
+    fanout: int = 5,
+    n_modes: int = 4,
+    n_scenarios: int = 6,
+    seed: int = 0,
+    n_rows: int | None = None,
+) -> pd.DataFrame:
+    """
+    Build a seeded DataFrame in the CSV layout described in the README: a sheet column,
+    `depth` grouping columns with `fanout` values each, a 'Mode' leaf column and
+    `n_scenarios` scenario columns.
+    If `n_rows` is given, enough modes are used to reach it and a random (but ordered)
+    subset of exactly `n_rows` rows is kept.
+    """
+    rng = np.random.default_rng(seed)
+    if n_rows is not None:
+        n_modes = max(1, math.ceil(n_rows / (n_sheets * fanout**depth)))
+    level_sizes = [n_sheets] + [fanout] * depth + [n_modes]
+    n_combinations = int(np.prod(level_sizes))
+
+    # every combination of group labels, in nested order
+    codes = np.indices(level_sizes).reshape(len(level_sizes), n_combinations)
+    if n_rows is not None and n_rows < n_combinations:
+        keep = np.sort(rng.choice(n_combinations, size=n_rows, replace=False))
+        codes = codes[:, keep]
+
+    columns = {"Group": np.char.add("Sheet ", codes[0].astype(str))}
+    for level in range(1, depth + 1):
+        columns[f"Level{level}"] = np.char.add(f"L{level} ", codes[level].astype(str))
+    columns["Mode"] = np.char.add("Mode ", codes[-1].astype(str))
+
+    df = pd.DataFrame(columns)
+    for i in range(n_scenarios):
+        df[f"Scenario {i} {2020 + 5 * i}"] = rng.random(len(df)) * 1000
+    return df
+
+
+@click.command()
+@click.argument("output_path")
+@click.option("--sheets", default=10)
+@click.option("--depth", default=2)
+@click.option("--fanout", default=5)
+@click.option("--modes", default=4)
+@click.option("--scenarios", default=6)
+@click.option("--rows", type=int, default=None, help="Exact row count (sets --modes).")
+@click.option("--seed", default=0)
+def main(output_path, sheets, depth, fanout, modes, scenarios, rows, seed) -> None:
+    df = make_df(sheets, depth, fanout, modes, scenarios, seed, rows)
+    df.to_csv(output_path, index=False)
+    click.echo(f"wrote {len(df):,} rows to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
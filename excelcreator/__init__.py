@@ -0,0 +1,11 @@
+# the library API is imported on first use, so the command line tools don't pay for
+# importing pandas before they need it
+__all__ = ["to_xlsx_bytes", "write_xlsx"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        from . import api
+
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,41 @@
+import io
+import os
+from typing import BinaryIO
+
+import pandas as pd
+
+from .creators import create_xl_from_df
+from .utils import df_from_clargs
+
+
+def read_input(data) -> pd.DataFrame:
+    """
+    `data` as a DataFrame: DataFrames are used as they are, paths are read with
+    `df_from_clargs` and anything else is read as a CSV file object (text or binary).
+    """
+    if isinstance(data, pd.DataFrame):
+        # the conversion replaces the sheet column, leave the caller's frame alone
+        return data.copy(deep=False)
+    if isinstance(data, (str, os.PathLike)):
+        return df_from_clargs(os.fspath(data))
+    return pd.read_csv(data)
+
+
+def write_xlsx(data, output: BinaryIO, **options) -> None:
+    """
+    Convert `data` (a DataFrame, the path of an input file or a CSV file object) and
+    write the workbook to the binary file object `output`, which needn't be seekable.
+    The workbook is built in memory, nothing is written to disk. `options` are passed on
+    to `create_xl_from_df` (`formula_mode`, `workers`, `cache`, `streaming`, `profiler`,
+    `scenario_dtype`, `max_sheet_rows`, `max_index_urls`, `subtotals`).
+    """
+    create_xl_from_df(read_input(data), output, **options)
+
+
+def to_xlsx_bytes(data, **options) -> bytes:
+    """
+    Convert `data` as `write_xlsx` does and return the contents of the .xlsx file.
+    """
+    output = io.BytesIO()
+    write_xlsx(data, output, **options)
+    return output.getvalue()
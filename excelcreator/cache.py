@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from .layout import RowPlan
+
+# bump whenever the layout of a prepared sheet, or the XML written for it, changes, so old
+# cache entries are ignored
+CACHE_VERSION = "4"
+
+
+class SheetCache:
+    """
+    Directory of prepared sheets (see `creators.prepare_sheet`), keyed by a hash of each
+    sheet's input rows and the settings that affect its layout, and of the XML written
+    for each sheet part (see `writer.render_sheet`), keyed by a hash of the part and the
+    settings that affect its XML. Entries that aren't used any more are left in place;
+    delete the directory to clear them.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, sheet_df: pd.DataFrame, row_offset: int) -> str:
+        """
+        Content hash of `sheet_df` (values and column names) and the layout settings.
+        """
+        h = hashlib.sha256()
+        h.update(f"{CACHE_VERSION}|{row_offset}|".encode())
+        h.update("\x1f".join(map(str, sheet_df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(sheet_df, index=False).to_numpy().tobytes())
+        return h.hexdigest()
+
+    def part_key(
+        self, sheetname: str, scenarionames: list[str], plan: RowPlan, *settings
+    ) -> str:
+        """
+        Content hash of a sheet part, its name and scenarios, and the write `settings`.
+        """
+        h = hashlib.sha256()
+        header = (CACHE_VERSION, xlsxwriter.__version__, sheetname, scenarionames)
+        h.update(repr((*header, plan.first_row, *settings)).encode())
+        # (labels are strings or None, whose repr tells them apart)
+        h.update(repr(plan.labels.tolist()).encode())
+        arrays = (plan.indents, plan.styles, plan.data, plan.values, plan.parents)
+        if plan.subtotals is not None:
+            arrays = (*arrays, plan.subtotals)
+        for array in arrays:
+            h.update(f"|{array.dtype.str}{array.shape}|".encode())
+            h.update(np.ascontiguousarray(array).tobytes())
+        return h.hexdigest()
+
+    def part_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.xml")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def load(self, key: str):
+        with open(self._path(key), "rb") as f:
+            return pickle.load(f)
+
+    def store(self, key: str, prepared) -> None:
+        # write to a temp file first so an interrupted run never leaves a broken entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(prepared, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        logging.debug(f"cached prepared sheet {key}")
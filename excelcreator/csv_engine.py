@@ -0,0 +1,185 @@
+import csv
+import logging
+import sys
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .layout import RowPlan, layout_sheet
+from .options import MAX_INDEX_URLS, MAX_SHEET_ROWS
+from .profiling import NULL_PROFILER, Profiler
+from .schema import Schema, nest_groups
+from .sheetnames import SheetNameResolver
+from .writer import ROW_OFFSET, write_workbook
+
+
+@dataclass
+class SheetRows:
+    """
+    The rows of one sheet as read by `read_csv_sheets`. `groups` maps the grouping keys
+    of each group (in order of first appearance) to the indices of its rows, `leaves`
+    holds each row's leaf key and `values` its scenario values, one float64 row each.
+    """
+
+    groups: dict[tuple[str, ...], array] = field(default_factory=dict)
+    leaves: list[str] = field(default_factory=list)
+    buffer: array = field(default_factory=lambda: array("d"))
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.leaves)
+
+    @property
+    def values(self) -> np.ndarray:
+        # a view of `buffer`, which is never appended to once the file is read
+        return np.frombuffer(self.buffer, dtype=np.float64).reshape(self.n_rows, -1)
+
+
+def parse_floats(texts: list[str]) -> list[float]:
+    """
+    Scenario values of a row as floats. Blanks, and anything else that isn't a number,
+    become NaN.
+    """
+    try:
+        return [float(text or "nan") for text in texts]
+    except ValueError:
+        pass
+    floats = []
+    for text in texts:
+        try:
+            floats.append(float(text))
+        except ValueError:
+            floats.append(float("nan"))
+    return floats
+
+
+def read_csv_sheets(
+    input_csv_path: str, columns: list[str] | None = None
+) -> tuple[Schema, dict[str, SheetRows]]:
+    """
+    Stream the CSV at `input_csv_path` (only `columns`, in that order, if given) into one
+    `SheetRows` per sheet, in order of first appearance, without building a DataFrame.
+    Sheet names are resolved as `shorten_long_sheetnames` does; every key is read as
+    text and interned, so repeated labels are stored once.
+    """
+    intern = sys.intern
+    with open(input_csv_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if columns is None:
+            columns = header
+        positions = {name: i for i, name in enumerate(header)}
+        missing = [name for name in columns if name not in positions]
+        if missing:
+            raise ValueError(f"Columns not found in {input_csv_path}: {missing}")
+
+        schema = Schema.from_columns(columns)
+        sheet_pos = positions[schema.sheet_col]
+        group_pos = [positions[name] for name in schema.group_cols]
+        leaf_pos = positions[schema.leaf_col]
+        scenario_pos = [positions[name] for name in schema.scenario_cols]
+
+        sheets = {}
+        sheetnames = {}
+        resolver = SheetNameResolver()
+        for row in reader:
+            if not row:
+                continue
+            name = row[sheet_pos]
+            sheetname = sheetnames.get(name)
+            if sheetname is None:
+                sheetname = sheetnames[name] = intern(resolver(name))
+            sheet = sheets.get(sheetname)
+            if sheet is None:
+                sheet = sheets[sheetname] = SheetRows()
+
+            key = (sheetname, *[intern(row[i]) for i in group_pos])
+            rows = sheet.groups.get(key)
+            if rows is None:
+                rows = sheet.groups[key] = array("q")
+            rows.append(sheet.n_rows)
+            sheet.leaves.append(intern(row[leaf_pos]))
+            sheet.buffer.extend(parse_floats([row[i] for i in scenario_pos]))
+
+    if resolver.changed:
+        logging.info("Sheet names shortened to be < 31 chars")
+    return schema, sheets
+
+
+def nonempty_scenarios(schema: Schema, values: np.ndarray) -> list[int]:
+    """
+    Positions of the scenario columns of `values` holding more than one distinct value
+    (blanks count as one value), as `Schema.nonempty_scenarios` picks them.
+    """
+    keep = []
+    for i in range(values.shape[1]):
+        column = values[:, i]
+        blank = np.isnan(column)
+        n_distinct = len(np.unique(column[~blank])) + bool(blank.any())
+        if n_distinct > 1:
+            keep.append(i)
+    return keep
+
+
+def prepare_csv_sheet(
+    sheet: SheetRows, row_offset: int, schema: Schema
+) -> tuple[list[str], RowPlan]:
+    """
+    What `creators.prepare_sheet` makes of a sheet's DataFrame, from its `SheetRows`.
+    """
+    keep = nonempty_scenarios(schema, sheet.values)
+    scenarionames = [schema.scenario_cols[i] for i in keep]
+    values = sheet.values[:, keep]
+
+    sheet_dict = nest_groups(
+        (
+            branch,
+            [sheet.leaves[i] for i in rows],
+            values[np.frombuffer(rows, np.int64)].tolist(),
+        )
+        for branch, rows in sheet.groups.items()
+    )
+
+    plan = layout_sheet(sheet_dict, row_offset, len(scenarionames))
+    return scenarionames, plan
+
+
+def prepare_csv_sheets(
+    sheets: dict[str, SheetRows], row_offset: int, schema: Schema
+) -> Iterator[tuple[list[str], RowPlan]]:
+    # each sheet's rows are dropped once it's laid out, they aren't needed for writing
+    for sheetname in list(sheets):
+        yield prepare_csv_sheet(sheets.pop(sheetname), row_offset, schema)
+
+
+# The counterpart of `create_xl_from_df` for the "csv" engine: reads the CSV with the csv
+# module (see `read_csv_sheets`) and writes the same workbook. Single process, no cache.
+def create_xl_from_csv(
+    input_csv_path: str,
+    excel_out_path,
+    streaming: bool = False,
+    formula_mode: str = "offset",
+    profiler: Profiler = NULL_PROFILER,
+    columns: list[str] | None = None,
+    max_sheet_rows: int = MAX_SHEET_ROWS,
+    max_index_urls: int = MAX_INDEX_URLS,
+    subtotals: str = "none",
+) -> None:
+    with profiler.stage("read_csv_sheets") as record:
+        schema, sheets = read_csv_sheets(input_csv_path, columns)
+        record["rows"] = sum(sheet.n_rows for sheet in sheets.values())
+
+    write_workbook(
+        excel_out_path,
+        {sheetname: sheet.n_rows for sheetname, sheet in sheets.items()},
+        prepare_csv_sheets(sheets, ROW_OFFSET, schema),
+        len(schema.groupnames),
+        streaming,
+        formula_mode,
+        profiler,
+        max_sheet_rows,
+        max_index_urls,
+        subtotals,
+    )
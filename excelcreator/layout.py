@@ -0,0 +1,376 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from xlsxwriter.utility import xl_col_to_name
+
+from .options import MAX_SHEET_ROWS
+from .schema import NestedDict, vals_are_lists
+
+# style ids for the rows of a `RowPlan`
+STYLE_SHEET = 0  # the "-- sheet name --" row at the top of a sheet's data
+STYLE_HEADER = 1  # first grouping level, in bold
+STYLE_GROUP = 2  # deeper grouping levels
+STYLE_LEAF = 3  # rows holding scenario data
+STYLE_BLANK = 4  # empty row closing a block of leaves
+
+# rows that get a left border in the first scenario column
+BORDERED_STYLES = (STYLE_SHEET, STYLE_HEADER)
+
+# rows heading a group, which can hold its subtotals (see `add_subtotals`)
+GROUP_STYLES = (STYLE_SHEET, STYLE_HEADER, STYLE_GROUP)
+
+# (bold, font size) of the label of each style of row that has one
+LABEL_FONTS = {
+    STYLE_SHEET: (True, 9),
+    STYLE_HEADER: (True, 8),
+    STYLE_GROUP: (False, 8),
+    STYLE_LEAF: (False, 8),
+}
+
+
+@dataclass
+class RowPlan:
+    """
+    Columnar layout of a sheet's data rows, one entry per worksheet row from `first_row`.
+    `data` indexes into the rows of `values` (-1 for rows without scenario data).
+    `parents` holds the index of the group row each row belongs to (-1 for the sheet row,
+    blank rows and rows whose group starts on an earlier part, see `split_plan`).
+    `links` holds the (name, row) of each top-level group, for the Index sheet.
+    `subtotals` marks the group rows whose data are subtotals worked out by
+    `add_subtotals` (None if there are none) rather than read from the input.
+    """
+
+    first_row: int
+    labels: np.ndarray
+    indents: np.ndarray
+    styles: np.ndarray
+    data: np.ndarray
+    values: np.ndarray
+    parents: np.ndarray
+    links: list[tuple[str, int]] = field(default_factory=list)
+    subtotals: np.ndarray | None = None
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.labels)
+
+    @property
+    def n_cells(self) -> int:
+        """
+        Number of cells `create_data_rows` writes: labels, borders, and the scenario
+        values and four comparison formulas of every row with data.
+        """
+        n_labels = int(np.count_nonzero(self.labels != None))  # noqa: E711
+        n_borders = int(np.isin(self.styles, BORDERED_STYLES).sum())
+        n_data = int(np.count_nonzero(self.data >= 0))
+        return n_labels + n_borders + n_data * (self.values.shape[1] + 4)
+
+
+def to_float_matrix(datavecs: list[list], n_cols: int) -> np.ndarray:
+    """
+    Stack scenario data lists into a float64 matrix. Blanks (and anything else that
+    isn't a number) become NaN.
+    """
+    if not datavecs:
+        return np.empty((0, n_cols), dtype=np.float64)
+    try:
+        # all numbers already (no blanks)
+        return np.array(datavecs, dtype=np.float64).reshape(len(datavecs), n_cols)
+    except (ValueError, TypeError):
+        pass
+    # (pandas is only needed here, and not by the engines that avoid it)
+    import pandas as pd
+
+    flat = pd.to_numeric(np.ravel(np.array(datavecs, dtype=object)), errors="coerce")
+    return np.asarray(flat, dtype=np.float64).reshape(len(datavecs), -1)
+
+
+def column_widths(n_scenarios: int, full_width: bool = True) -> list[tuple[str, float]]:
+    """
+    Widths of a sheet's columns, as (columns, width) pairs for `set_column`. Every column
+    holding data has a fixed width, so nothing is left to autofit. The scenario columns
+    run to the last column of the sheet if `full_width`, else to the last scenario.
+    Column F is set separately, with its border (see `create_dynamic_block`).
+    """
+    last_col = "XFD" if full_width else xl_col_to_name(6 + n_scenarios - 1)
+    return [
+        ("A:A", 33.33),
+        ("B:B", 10.67),
+        ("C:C", 10.67),
+        ("D:D", 10.67),
+        ("E:E", 5),
+        (f"G:{last_col}", 10.67),
+    ]
+
+
+def comparison_values(values: np.ndarray) -> np.ndarray:
+    """
+    What the comparison formulas in columns B to E work out to for each row of `values`,
+    with the first two scenarios picked in the dropdowns: both scenarios' values, the
+    difference and the percent change. NaN where the formula shows "-".
+    """
+    # blank scenario cells are looked up as 0
+    picked = np.nan_to_num(values[:, :2], nan=0.0)
+    first, second = picked[:, 0], picked[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(first != 0, second / first - 1, np.nan)
+    return np.column_stack((first, second, second - first, pct))
+
+
+def layout_sheet(sheet_dict: NestedDict, first_row: int, n_scenarios: int) -> RowPlan:
+    """
+    Lay out the rows of `sheet_dict` (as built by `df_to_dict`) starting at `first_row`,
+    without touching a worksheet.
+    """
+    labels, indents, styles, data, parents = [], [], [], [], []
+    datavecs = []
+    links = []
+
+    def add_row(label, indent: int, style: int, parent: int) -> None:
+        labels.append(label)
+        indents.append(indent)
+        styles.append(style)
+        data.append(-1)
+        parents.append(parent)
+
+    # (warning: recursion)
+    def add_rows(in_dict: NestedDict, ind_level: int, parent: int) -> None:
+        if vals_are_lists(in_dict):
+            # a "--" leaf holds the data for the row just above the block
+            above = len(labels) - 1
+            for name, datavec in in_dict.items():
+                if name == "--":
+                    data[above] = len(datavecs)
+                else:
+                    add_row(name, ind_level + 1, STYLE_LEAF, parent)
+                    data[-1] = len(datavecs)
+                datavecs.append(datavec)
+            add_row(None, 0, STYLE_BLANK, -1)
+            return
+
+        for name, nested_dict in in_dict.items():
+            if ind_level == 0:
+                links.append((name, first_row + len(labels)))
+                add_row("-- " + name + " --", ind_level, STYLE_SHEET, parent)
+            elif ind_level == 1:
+                add_row(name, ind_level, STYLE_HEADER, parent)
+            elif name == "--":
+                # "--" groups don't get a row of their own
+                add_rows(nested_dict, ind_level, parent)
+                continue
+            else:
+                add_row(name, ind_level, STYLE_GROUP, parent)
+            add_rows(nested_dict, ind_level + 1, len(labels) - 1)
+
+    add_rows(sheet_dict, 0, -1)
+
+    return RowPlan(
+        first_row=first_row,
+        labels=np.array(labels, dtype=object),
+        indents=np.array(indents, dtype=np.int8),
+        styles=np.array(styles, dtype=np.uint8),
+        data=np.array(data, dtype=np.int32),
+        values=to_float_matrix(datavecs, n_scenarios),
+        parents=np.array(parents, dtype=np.int32),
+        links=links,
+    )
+
+
+def plan_part(
+    plan: RowPlan, start: int, stop: int, title: str | None = None
+) -> RowPlan:
+    """
+    The rows `start` to `stop` of `plan`, as a plan of their own starting at the same
+    `first_row`, with only the scenario values they use. With a `title`, the part opens
+    with a "-- title --" row (linked from the Index sheet).
+    """
+    data = plan.data[start:stop]
+    used, inverse = np.unique(data[data >= 0], return_inverse=True)
+    data = data.copy()
+    data[data >= 0] = inverse
+
+    labels = plan.labels[start:stop]
+    indents = plan.indents[start:stop]
+    styles = plan.styles[start:stop]
+    # groups that started on an earlier part lose their children here
+    parents = np.where(plan.parents[start:stop] >= start, plan.parents[start:stop], -1)
+    parents = np.where(parents >= 0, parents - start, -1)
+    subtotals = None
+    if plan.subtotals is not None:
+        subtotals = plan.subtotals[start:stop].copy()
+        # groups that carry on past this part keep their subtotals, but can't sum their
+        # rows with a formula. Blank rows belong to no group, so look for them from the
+        # first row after this part that isn't blank.
+        row = stop
+        while row < plan.n_rows and plan.styles[row] == STYLE_BLANK:
+            row += 1
+        parent = plan.parents[row] if row < plan.n_rows else -1
+        while parent >= start:
+            subtotals[parent - start] = False
+            parent = plan.parents[parent]
+
+    shift = -start
+    links = []
+    if title is not None:
+        labels = np.concatenate(
+            (np.array(["-- " + title + " --"], dtype=object), labels)
+        )
+        indents = np.concatenate(([0], indents)).astype(np.int8)
+        styles = np.concatenate(([STYLE_SHEET], styles)).astype(np.uint8)
+        data = np.concatenate(([-1], data))
+        parents = np.concatenate(([-1], np.where(parents >= 0, parents + 1, -1)))
+        if subtotals is not None:
+            subtotals = np.concatenate(([False], subtotals))
+        links.append((title, plan.first_row))
+        shift += 1
+    first, last = plan.first_row + start, plan.first_row + stop
+    links += [(name, row + shift) for name, row in plan.links if first <= row < last]
+
+    return RowPlan(
+        first_row=plan.first_row,
+        labels=labels,
+        indents=indents,
+        styles=styles,
+        data=data.astype(np.int32),
+        values=plan.values[used],
+        parents=parents.astype(np.int32),
+        links=links,
+        subtotals=subtotals,
+    )
+
+
+def split_plan(
+    plan: RowPlan, sheetname: str, max_rows: int = MAX_SHEET_ROWS
+) -> list[RowPlan]:
+    """
+    Split `plan` into parts that each fit in a worksheet of `max_rows` rows: the first
+    part, then continuation parts headed "-- sheetname (continued) --". Parts end before
+    a first-level group where possible, else before a deeper group, else at the last row
+    that fits (but not just before a blank row). A cut is only taken if the part it ends
+    holds some of the input's data. A plan that fits is returned as it is.
+    """
+    room = max_rows - plan.first_row
+    if plan.n_rows <= room:
+        return [plan]
+    # continuation parts lose a row to their title, and need two more so that a blank row
+    # can stay with the row it closes
+    if room < 3:
+        raise ValueError(f"{max_rows} rows leave no room for data below the header")
+
+    # rows each part may start at, in order of preference
+    cuts_by_level = [
+        np.flatnonzero(plan.styles == STYLE_HEADER),
+        np.flatnonzero(plan.styles == STYLE_GROUP),
+    ]
+    # rows of input data before each row (subtotals don't count), so that no part is
+    # left with nothing but group labels where a later cut would do
+    input_rows = plan.data >= 0
+    if plan.subtotals is not None:
+        input_rows &= ~plan.subtotals
+    data_before = np.concatenate(([0], np.cumsum(input_rows)))
+    bounds = [0]
+    while plan.n_rows - bounds[-1] > room:
+        start = bounds[-1]
+        stop = start + room
+        for cuts in cuts_by_level:
+            i = np.searchsorted(cuts, stop, side="right") - 1
+            if i >= 0 and cuts[i] > start and data_before[cuts[i]] > data_before[start]:
+                stop = int(cuts[i])
+                break
+        else:
+            # a blank row stays with the rows it closes
+            if plan.styles[stop] == STYLE_BLANK and stop - 1 > start:
+                stop -= 1
+        bounds.append(stop)
+        room = max_rows - plan.first_row - 1
+    bounds.append(plan.n_rows)
+
+    title = f"{sheetname} (continued)"
+    return [
+        plan_part(plan, start, stop, title if start else None)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def row_depths(parents: np.ndarray) -> np.ndarray:
+    """
+    How many groups each row is nested in, from the `parents` of a `RowPlan`.
+    """
+    depths = np.zeros(len(parents), dtype=np.int32)
+    ancestors = parents.copy()
+    while np.any(ancestors >= 0):
+        nested = ancestors >= 0
+        depths[nested] += 1
+        ancestors[nested] = parents[ancestors[nested]]
+    return depths
+
+
+def add_subtotals(plan: RowPlan) -> RowPlan:
+    """
+    `plan` with the subtotals of each group, for every scenario, as the data of its group
+    row (the sheet row getting the sheet total). A group's subtotal is the sum of its
+    rows: its leaves' values and its subgroups' subtotals, so a group row that already
+    has data (from a "--" row in the input) counts with that data and is left as it is.
+    Blank values are skipped; a group whose rows are all blank stays blank.
+    Sums are worked out level by level, deepest first, for all groups of a level at once.
+    """
+    n_scenarios = plan.values.shape[1]
+    has_data = plan.data >= 0
+    open_groups = np.isin(plan.styles, GROUP_STYLES) & ~has_data
+
+    totals = np.full((plan.n_rows, n_scenarios), np.nan)
+    totals[has_data] = plan.values[plan.data[has_data]]
+    depths = row_depths(plan.parents)
+    for depth in range(int(depths.max(initial=0)), 0, -1):
+        rows = np.flatnonzero(depths == depth)
+        rows = rows[open_groups[plan.parents[rows]]]
+        if not len(rows):
+            continue
+        groups, inverse = np.unique(plan.parents[rows], return_inverse=True)
+        values = totals[rows]
+        blank = np.isnan(values)
+        sums = np.zeros((len(groups), n_scenarios))
+        counts = np.zeros((len(groups), n_scenarios), dtype=np.int64)
+        np.add.at(sums, inverse, np.where(blank, 0.0, values))
+        np.add.at(counts, inverse, ~blank)
+        totals[groups] = np.where(counts > 0, sums, np.nan)
+
+    subtotals = open_groups & ~np.all(np.isnan(totals), axis=1)
+    rows = np.flatnonzero(subtotals)
+    data = plan.data.copy()
+    data[rows] = len(plan.values) + np.arange(len(rows), dtype=np.int32)
+    return RowPlan(
+        first_row=plan.first_row,
+        labels=plan.labels,
+        indents=plan.indents,
+        styles=plan.styles,
+        data=data,
+        values=np.concatenate((plan.values, totals[rows])),
+        parents=plan.parents,
+        links=plan.links,
+        subtotals=subtotals,
+    )
+
+
+def subtotal_runs(plan: RowPlan) -> dict[int, list[tuple[int, int]]]:
+    """
+    For each subtotal row of `plan` (see `add_subtotals`), the worksheet rows holding
+    what it sums, as (first, last) runs of consecutive rows.
+    """
+    if plan.subtotals is None:
+        return {}
+    rows = np.flatnonzero((plan.parents >= 0) & (plan.data >= 0))
+    rows = rows[plan.subtotals[plan.parents[rows]]]
+    if not len(rows):
+        return {}
+    rows = rows[np.argsort(plan.parents[rows], kind="stable")]
+    groups = plan.parents[rows]
+    bounds = np.flatnonzero(np.diff(groups)) + 1
+
+    runs = {}
+    for group, children in zip(groups[np.r_[0, bounds]], np.split(rows, bounds)):
+        breaks = np.flatnonzero(np.diff(children) != 1) + 1
+        firsts = children[np.r_[0, breaks]] + plan.first_row
+        lasts = children[np.r_[breaks - 1, len(children) - 1]] + plan.first_row
+        runs[int(group)] = list(zip(firsts.tolist(), lasts.tolist()))
+    return runs
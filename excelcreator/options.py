@@ -0,0 +1,38 @@
+# values accepted by the command line options, kept in a module without heavy imports
+# so that the CLI can build its options (and `--help`) without loading pandas
+
+# ways of writing the scenario lookups in columns B and C, see `create_xl_from_df`
+FORMULA_MODES = ("offset", "index")
+
+# Excel's limit on the rows of a worksheet; sheets that would run past it are split into
+# continuation sheets, see `layout.split_plan`
+MAX_SHEET_ROWS = 1_048_576
+
+# the fewest rows a sheet can be split into: the header block (`writer.ROW_OFFSET` rows),
+# a continuation sheet's title, a data row and the blank row that may close it
+MIN_SHEET_ROWS = 6
+
+# hyperlinks a worksheet can hold (Excel's limit); Index entries past it are written as
+# HYPERLINK formulas instead, see `writer.write_index_entries`
+MAX_INDEX_URLS = 65_530
+
+# subtotal rows for each group, see `layout.add_subtotals`: none, static values, or SUM
+# formulas (with their values cached)
+SUBTOTAL_MODES = ("none", "values", "formulas")
+
+# connections `createxl-serve` serves at once (a thread each) by default
+MAX_CONNECTIONS = 64
+
+# ways of reading the input and building the sheets, see `toexcel.run`
+ENGINES = ("pandas", "csv", "polars")
+
+# input file formats, by file extension
+INPUT_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".ipc": "arrow",
+}
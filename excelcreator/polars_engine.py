@@ -0,0 +1,151 @@
+import logging
+from collections.abc import Iterator
+
+import numpy as np
+import polars as pl
+
+from .layout import RowPlan, layout_sheet
+from .options import MAX_INDEX_URLS, MAX_SHEET_ROWS
+from .profiling import NULL_PROFILER, Profiler
+from .schema import Schema, nest_groups, run_bounds
+from .sheetnames import resolve_sheetnames
+from .writer import ROW_OFFSET, write_workbook
+
+# helper columns added by `scan_sheets`
+ROW_COL = "__row"
+SHEET_RANK_COL = "__sheet"
+GROUP_RANK_COL = "__group"
+
+
+def scan_input(
+    input_path: str, input_format: str = "csv", columns: list[str] | None = None
+) -> pl.LazyFrame:
+    """
+    Lazily scan the input file. CSV columns are all read as text; scenario columns are
+    converted in `scan_sheets`, so keys keep exactly the text in the file.
+    """
+    if input_format == "csv":
+        lf = pl.scan_csv(input_path, infer_schema=False)
+    elif input_format == "parquet":
+        lf = pl.scan_parquet(input_path)
+    elif input_format in ("feather", "arrow"):
+        lf = pl.scan_ipc(input_path)
+    else:
+        raise ValueError(f"Unknown input format {input_format!r}")
+    if columns is not None:
+        lf = lf.select(columns)
+    return lf
+
+
+def scan_sheets(lf: pl.LazyFrame, schema: Schema) -> pl.LazyFrame:
+    """
+    The query that turns keys into text and scenarios into floats, and sorts the rows by
+    sheet and then by group (each in order of first appearance, as `partition_sheets`
+    and `df_to_dict` order them), keeping the file order within a group. Sheet names are
+    resolved afterwards, once per sheet, see `read_polars_sheets`.
+    """
+    branchnames = [schema.sheet_col, *schema.group_cols]
+    keys = [*branchnames, schema.leaf_col]
+    lf = lf.with_row_index(ROW_COL).with_columns(
+        pl.col(keys).cast(pl.String).fill_null(""),
+        pl.col(schema.scenario_cols).cast(pl.Float64, strict=False),
+    )
+    return lf.with_columns(
+        pl.col(ROW_COL).min().over(schema.sheet_col).alias(SHEET_RANK_COL),
+        pl.col(ROW_COL).min().over(branchnames).alias(GROUP_RANK_COL),
+    ).sort(SHEET_RANK_COL, GROUP_RANK_COL, ROW_COL)
+
+
+def read_polars_sheets(
+    input_path: str, input_format: str = "csv", columns: list[str] | None = None
+) -> tuple[Schema, dict[str, pl.DataFrame]]:
+    """
+    Read the input and split it into one sorted frame (a zero-copy slice) per sheet, in
+    order of first appearance, keyed by its resolved sheet name (see
+    `sheetnames.SheetNameResolver`).
+    """
+    lf = scan_input(input_path, input_format, columns)
+    schema = Schema.from_columns(lf.collect_schema().names())
+    df = scan_sheets(lf, schema).collect()
+
+    starts, stops = run_bounds(df[SHEET_RANK_COL].to_numpy())
+    sheetnames = resolve_sheetnames(df[schema.sheet_col].gather(starts).to_list())
+    if any(raw != name for raw, name in sheetnames.items()):
+        logging.info("Sheet names shortened to be < 31 chars")
+    df = df.with_columns(
+        pl.col(schema.sheet_col).replace_strict(sheetnames, return_dtype=pl.String)
+    )
+
+    sheets = {
+        name: df.slice(start, stop - start)
+        for name, start, stop in zip(sheetnames.values(), starts, stops)
+    }
+    return schema, sheets
+
+
+def prepare_polars_sheet(
+    sheet_df: pl.DataFrame, row_offset: int, schema: Schema
+) -> tuple[list[str], RowPlan]:
+    """
+    What `creators.prepare_sheet` makes of a sheet's DataFrame, from its sorted frame.
+    """
+    # missing values count as one value, as blanks do in `Schema.nonempty_scenarios`
+    counts = sheet_df.select(pl.col(schema.scenario_cols).n_unique()).row(0)
+    scenarionames = [name for name, n in zip(schema.scenario_cols, counts) if n > 1]
+    if scenarionames:
+        values = sheet_df.select(scenarionames).to_numpy().astype(np.float64)
+    else:
+        values = np.empty((len(sheet_df), 0), dtype=np.float64)
+
+    # rows are sorted by group already, so each group is a contiguous block
+    starts, stops = run_bounds(sheet_df[GROUP_RANK_COL].to_numpy())
+    branchnames = [schema.sheet_col, *schema.group_cols]
+    branches = sheet_df.select(branchnames)[starts].rows()
+    leaves = sheet_df[schema.leaf_col].to_list()
+    sheet_dict = nest_groups(
+        (branch, leaves[start:stop], values[start:stop].tolist())
+        for branch, start, stop in zip(branches, starts, stops)
+    )
+
+    plan = layout_sheet(sheet_dict, row_offset, len(scenarionames))
+    return scenarionames, plan
+
+
+def prepare_polars_sheets(
+    sheets: dict[str, pl.DataFrame], row_offset: int, schema: Schema
+) -> Iterator[tuple[list[str], RowPlan]]:
+    for sheet_df in sheets.values():
+        yield prepare_polars_sheet(sheet_df, row_offset, schema)
+
+
+# The counterpart of `create_xl_from_df` for the "polars" engine: reading, partitioning
+# and grouping run as one multithreaded Polars query, and the same workbook is written.
+# Single process, no cache.
+def create_xl_from_polars(
+    input_path: str,
+    excel_out_path,
+    input_format: str = "csv",
+    streaming: bool = False,
+    formula_mode: str = "offset",
+    profiler: Profiler = NULL_PROFILER,
+    columns: list[str] | None = None,
+    max_sheet_rows: int = MAX_SHEET_ROWS,
+    max_index_urls: int = MAX_INDEX_URLS,
+    subtotals: str = "none",
+) -> None:
+    with profiler.stage("read_polars_sheets") as record:
+        schema, sheets = read_polars_sheets(input_path, input_format, columns)
+        record["rows"] = sum(len(sheet_df) for sheet_df in sheets.values())
+
+    write_workbook(
+        excel_out_path,
+        {sheetname: len(sheet_df) for sheetname, sheet_df in sheets.items()},
+        prepare_polars_sheets(sheets, ROW_OFFSET, schema),
+        len(schema.groupnames),
+        streaming,
+        formula_mode,
+        profiler,
+        max_sheet_rows,
+        max_index_urls,
+        subtotals,
+    )
@@ -0,0 +1,121 @@
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process. On Linux this reads VmHWM, since ru_maxrss
+    also counts whatever the parent used before the child was exec'd.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # KiB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory of this process to its current size, so the next
+    `peak_rss_mb` covers only what happens in between. Linux only; returns whether the
+    peak could be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time and peak resident memory of each stage of a
+    conversion, per sheet for the stages that run once per sheet. Where the peak can't
+    be reset between stages (anywhere but Linux) it is the peak of the process so far.
+    Worker processes (`workers` > 1) aren't included in the CPU time or memory.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.per_stage_rss = reset_peak_rss()
+        self._start = (time.perf_counter(), time.process_time())
+
+    @contextlib.contextmanager
+    def stage(self, name: str, sheet: str | None = None):
+        """
+        Time the body of the `with` block as stage `name`. The record is yielded, so
+        counts (rows, cells, ...) can be added to it.
+        """
+        record = {"stage": name, "sheet": sheet}
+        if self.per_stage_rss:
+            reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_rss_mb"] = peak_rss_mb()
+            self.records.append(record)
+
+    def report(self, **extra) -> dict:
+        """
+        Everything recorded so far: totals for each stage (in the order they first ran),
+        followed by the individual records. `extra` is added at the top level.
+        """
+        stages = {}
+        for record in self.records:
+            totals = stages.setdefault(
+                record["stage"],
+                {"wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0},
+            )
+            totals["wall_seconds"] += record["wall_seconds"]
+            totals["cpu_seconds"] += record["cpu_seconds"]
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+            for key, value in record.items():
+                if key in ("rows", "cells", "input_rows"):
+                    totals[key] = totals.get(key, 0) + value
+
+        start_wall, start_cpu = self._start
+        return {
+            "python": platform.python_version(),
+            "pid": os.getpid(),
+            "wall_seconds": time.perf_counter() - start_wall,
+            "cpu_seconds": time.process_time() - start_cpu,
+            "peak_rss_per_stage": self.per_stage_rss,
+            **extra,
+            "stages": stages,
+            "records": self.records,
+        }
+
+    def write_report(self, path: str, **extra) -> None:
+        with open(path, "w") as f:
+            json.dump(self.report(**extra), f, indent=2)
+
+
+class NullProfiler(Profiler):
+    """
+    Stand-in used when profiling is off: stages are not timed or recorded.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.per_stage_rss = False
+        self._start = (time.perf_counter(), time.process_time())
+
+    def stage(self, name: str, sheet: str | None = None):
+        return contextlib.nullcontext({})
+
+
+NULL_PROFILER = NullProfiler()
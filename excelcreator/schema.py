@@ -0,0 +1,113 @@
+import re
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+# the roles of the input columns and the nested dicts built from them, without importing
+# pandas (see `csv_engine`)
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# infinite dict class
+class NestedDict(dict):
+    def __getitem__(self, key):
+        if key in self:
+            return self.get(key)
+        else:
+            value = NestedDict()
+            self[key] = value
+            return value
+
+
+# https://stackoverflow.com/questions/23499017/know-the-depth-of-a-dictionary
+def dict_depth(d) -> int:
+    """
+    Calculates the depth of the dictionary, `d`
+    """
+    if isinstance(d, dict):
+        return 1 + (max(map(dict_depth, d.values())) if d else 0)
+    return 0
+
+
+def run_bounds(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The `starts` and `stops` of each run of equal values in `keys` (the group of each
+    row, with the rows sorted so that every group is contiguous).
+    """
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], bounds))
+    stops = np.concatenate((bounds, [len(keys)]))
+    return starts, stops
+
+
+def nest_groups(groups: Iterable[tuple[tuple, list, list]]) -> NestedDict:
+    """
+    Nest `groups`, given in order as (branch, leaves, values) with `branch` the grouping
+    keys from the sheet down, into a NestedDict holding each group's `leaves` mapped to
+    their `values`. Every engine builds its sheet dicts with this, so they nest alike.
+    """
+    nested = NestedDict()
+    # walk down to the parent of each group and attach the group's leaves in one go
+    for branch, leaves, values in groups:
+        parent = nested
+        for key in branch[:-1]:
+            parent = parent[key]
+        parent[branch[-1]] = dict(zip(leaves, values))
+    return nested
+
+
+def vals_are_lists(d: NestedDict) -> bool:
+    """
+    check whether the values (not the keys) in the dictionary `d` are lists
+    """
+    for key, value in d.items():
+        if not isinstance(value, list):
+            return False
+    return True
+
+
+# scenario columns are the ones with a year (ie. 2049) in their name
+SCENARIO_PATTERN = re.compile(r"(19|[2-9][0-9])\d{2}")
+
+
+@dataclass(frozen=True)
+class Schema:
+    """
+    Roles of the input columns, worked out once from their names: the sheet column
+    (first), the grouping columns, the leaf column (last non-scenario column) and the
+    scenario columns (those with a year in their name).
+    """
+
+    sheet_col: str
+    group_cols: tuple[str, ...]
+    leaf_col: str
+    scenario_cols: tuple[str, ...]
+
+    @classmethod
+    def from_columns(cls, columns) -> "Schema":
+        columns = list(columns)
+        scenario_cols = [name for name in columns if SCENARIO_PATTERN.search(name)]
+        groupnames = [name for name in columns if name not in scenario_cols]
+        return cls(
+            sheet_col=groupnames[0],
+            group_cols=tuple(groupnames[1:-1]),
+            leaf_col=groupnames[-1],
+            scenario_cols=tuple(scenario_cols),
+        )
+
+    @property
+    def groupnames(self) -> list[str]:
+        """
+        All non-scenario columns, in order (what `get_groups` returns).
+        """
+        return [self.sheet_col, *self.group_cols, self.leaf_col]
+
+    def nonempty_scenarios(self, df: "pd.DataFrame") -> list[str]:
+        """
+        Scenario columns of `df` holding more than one distinct value.
+        """
+        counts = df[list(self.scenario_cols)].nunique(dropna=False)
+        return [name for name in self.scenario_cols if counts[name] > 1]
@@ -0,0 +1,341 @@
+import collections
+import http.server
+import io
+import logging
+import os
+import signal
+import socketserver
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .api import to_xlsx_bytes
+from .options import FORMULA_MODES, MAX_CONNECTIONS
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# latency quantiles are taken over this many of the most recent conversions
+LATENCY_WINDOW = 1000
+
+# the reply to connections past `max_connections`
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+    b"Content-Length: 0\r\nConnection: close\r\n\r\n"
+)
+
+
+# Ctrl+C stops the server, which then shuts the workers down
+def init_worker() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# imports happen at module load, so this only makes sure a worker process has started
+def warm_up() -> None:
+    pass
+
+
+# run in a worker process, returns the workbook and the time spent converting
+def convert_upload(csv_bytes: bytes, formula_mode: str) -> tuple[bytes, float]:
+    start = time.perf_counter()
+    xlsx = to_xlsx_bytes(io.BytesIO(csv_bytes), formula_mode=formula_mode)
+    return xlsx, time.perf_counter() - start
+
+
+class ConversionService:
+    """
+    Runs conversions on a pool of `workers` processes, started (and warmed up) once.
+    An upload needs one of `workers` + `queue_size` slots before its body is read; when
+    none is free `reserve` refuses it (the server answers 503), so at most that many
+    uploads are held in memory at once.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+        self.latency_sum = 0.0
+        self.wait_sum = 0.0
+        self.completed = 0
+
+        for future in [self.pool.submit(warm_up) for _ in range(workers)]:
+            future.result()
+
+    def reserve(self) -> bool:
+        """
+        Take a slot for an upload, or return False straight away if the queue is full.
+        A slot taken is given back with `release`.
+        """
+        if not self.slots.acquire(blocking=False):
+            self.count("busy")
+            return False
+        return True
+
+    def release(self) -> None:
+        self.slots.release()
+
+    def submit(self, csv_bytes: bytes, formula_mode: str) -> bytes:
+        """
+        Convert `csv_bytes`, which hold a slot taken with `reserve`, blocking until done.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = self.pool.submit(convert_upload, csv_bytes, formula_mode)
+            xlsx, convert_seconds = future.result()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(seconds)
+            self.waits.append(seconds - convert_seconds)
+            self.latency_sum += seconds
+            self.wait_sum += seconds - convert_seconds
+            self.completed += 1
+        return xlsx
+
+    def count(self, status: str) -> None:
+        with self.lock:
+            self.counts[status] += 1
+
+    def metrics(self) -> str:
+        """
+        Current state in the Prometheus text format.
+        """
+        with self.lock:
+            in_flight = self.in_flight
+            counts = dict(self.counts)
+            latencies = np.array(self.latencies)
+            waits = np.array(self.waits)
+            latency_sum = self.latency_sum
+            wait_sum = self.wait_sum
+            completed = self.completed
+
+        lines = [
+            "# TYPE createxl_workers gauge",
+            f"createxl_workers {self.workers}",
+            "# TYPE createxl_in_flight gauge",
+            f"createxl_in_flight {in_flight}",
+            "# TYPE createxl_queue_depth gauge",
+            f"createxl_queue_depth {max(0, in_flight - self.workers)}",
+            "# TYPE createxl_requests_total counter",
+        ]
+        lines += [
+            f'createxl_requests_total{{status="{status}"}} {n}'
+            for status, n in sorted(counts.items())
+        ]
+        # each summary as one block: its quantiles, then its sum and count
+        summaries = [
+            ("latency", latencies, latency_sum),
+            ("queue_wait", waits, wait_sum),
+        ]
+        for name, samples, total in summaries:
+            lines.append(f"# TYPE createxl_{name}_seconds summary")
+            if len(samples):
+                for q in (0.5, 0.9, 0.99):
+                    value = np.quantile(samples, q)
+                    lines.append(
+                        f'createxl_{name}_seconds{{quantile="{q}"}} {value:.6f}'
+                    )
+            lines += [
+                f"createxl_{name}_seconds_sum {total}",
+                f"createxl_{name}_seconds_count {completed}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ConversionHandler(http.server.BaseHTTPRequestHandler):
+    """
+    POST /convert (the CSV as the request body, optional ?formulas=index&name=out.xlsx)
+    answers with the workbook. GET /metrics and GET /healthz report on the service.
+    """
+
+    server_version = "createxl"
+    protocol_version = "HTTP/1.1"
+    chunk_size = 1 << 16
+    # idle keep-alive connections are dropped, so they don't hold a connection slot
+    timeout = 60
+
+    def address_string(self) -> str:
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args) -> None:
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def send_text(self, status: int, text: str, content_type="text/plain") -> None:
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/metrics":
+            self.send_text(
+                200, self.server.service.metrics(), "text/plain; version=0.0.4"
+            )
+        elif path == "/healthz":
+            self.send_text(200, "ok\n")
+        else:
+            self.send_text(404, "not found\n")
+
+    def do_POST(self) -> None:
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        # replies sent before the body is read end the connection, or the body would be
+        # taken for the next request
+        if url.path != "/convert":
+            self.close_connection = True
+            self.send_text(404, "not found\n")
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        formula_mode = query.get("formulas", ["offset"])[0]
+        filename = os.path.basename(query.get("name", ["output.xlsx"])[0])
+        filename = filename.replace('"', "") or "output.xlsx"
+        if formula_mode not in FORMULA_MODES:
+            service.count("bad_request")
+            self.close_connection = True
+            self.send_text(400, f"formulas must be one of {', '.join(FORMULA_MODES)}\n")
+            return
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            service.count("bad_request")
+            self.close_connection = True
+            self.send_text(411, "Content-Length required\n")
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            service.count("bad_request")
+            self.close_connection = True
+            self.send_text(400, "Content-Length must be a number of bytes\n")
+            return
+        if length > self.server.max_upload_bytes:
+            service.count("too_large")
+            self.close_connection = True
+            self.send_text(413, "upload too large\n")
+            return
+        if not service.reserve():
+            self.close_connection = True
+            self.send_text(503, "busy, try again\n")
+            return
+
+        try:
+            self.convert(length, formula_mode, filename)
+        finally:
+            service.release()
+
+    def convert(self, length: int, formula_mode: str, filename: str) -> None:
+        service = self.server.service
+        try:
+            csv_bytes = self.rfile.read(length)
+        except OSError:
+            csv_bytes = b""
+        if len(csv_bytes) < length:
+            # the client went away, or stalled, part way through the upload
+            service.count("bad_request")
+            self.close_connection = True
+            return
+
+        try:
+            xlsx = service.submit(csv_bytes, formula_mode)
+        except (ValueError, KeyError, IndexError) as e:
+            # errors in the upload itself
+            service.count("bad_request")
+            self.send_text(400, f"{type(e).__name__}: {e}\n")
+            return
+        except Exception as e:
+            logging.exception("Conversion failed")
+            service.count("error")
+            self.send_text(500, f"{type(e).__name__}: {e}\n")
+            return
+
+        service.count("ok")
+        self.send_response(200)
+        self.send_header("Content-Type", XLSX_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(xlsx)))
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.end_headers()
+        view = memoryview(xlsx)
+        for start in range(0, len(view), self.chunk_size):
+            self.wfile.write(view[start : start + self.chunk_size])
+
+
+class ConversionServerMixIn(socketserver.ThreadingMixIn):
+    """
+    Serves `ConversionHandler` on a thread per connection, at most `max_connections`
+    at once. Connections past that get a 503 and are closed straight away.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        service: ConversionService,
+        max_upload_bytes: int,
+        max_connections: int = MAX_CONNECTIONS,
+    ):
+        self.service = service
+        self.max_upload_bytes = max_upload_bytes
+        self.connections = threading.BoundedSemaphore(max_connections)
+        super().__init__(address, ConversionHandler)
+
+    def process_request(self, request, client_address) -> None:
+        if not self.connections.acquire(blocking=False):
+            self.service.count("busy")
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connections.release()
+
+
+class ConversionServer(ConversionServerMixIn, http.server.HTTPServer):
+    pass
+
+
+class UnixConversionServer(ConversionServerMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def run_server(server, description: str) -> None:
+    logging.info(f"Serving conversions on {description} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+        logging.info("Server stopped")
@@ -0,0 +1,88 @@
+import logging
+
+# Excel sheet names for the sheets of a workbook (plain strings, no pandas needed)
+
+
+# replacements tried, in order, on sheet names longer than excel's 31 character limit
+SHEETNAME_REPLACEMENTS = [
+    ("Average", "Avg."),
+    ("Distance", "Dist."),
+    ("Distances", "Dists"),
+    ("Terminating", "Term."),
+    ("Originating", "Orig."),
+    ("Population", "Pop."),
+]
+
+
+def shorten_sheetname(name: str) -> str:
+    """
+    Shorten `name` to meet excel's 31 character limit: abbreviate common words, then
+    drop spaces, then truncate.
+    """
+    for frm, to in SHEETNAME_REPLACEMENTS:
+        if len(name) > 31:
+            name = name.replace(frm, to)
+    if len(name) > 31:
+        name = name.replace(" ", "")
+    if len(name) > 31:
+        name = name[0:31]
+    return name
+
+
+# the sheet listing every other sheet, so no data sheet can take its name
+INDEX_SHEETNAME = "Index"
+
+
+class SheetNameResolver:
+    """
+    Turns raw sheet names into unique Excel sheet names, each worked out once: names are
+    shortened with `shorten_sheetname`, and a name that is already taken (Excel compares
+    them case-insensitively) gets a "~2", "~3", ... suffix, cutting the name to make
+    room. Names are resolved in the order they're first seen, so the same input always
+    gives the same names.
+    """
+
+    def __init__(self, reserved: tuple[str, ...] = (INDEX_SHEETNAME,)):
+        self.names: dict[str, str] = {}
+        self.taken = {name.casefold() for name in reserved}
+
+    def __call__(self, raw: str) -> str:
+        name = self.names.get(raw)
+        if name is None:
+            name = self.names[raw] = self.dedupe(shorten_sheetname(raw))
+        return name
+
+    def dedupe(self, name: str, suffix: str = "") -> str:
+        """
+        `name` + `suffix`, or a variant of it that no other sheet has yet, which is
+        then taken. The "~n" tag goes between the two, so `suffix` is kept whole.
+        """
+        unique = wanted = name[: 31 - len(suffix)] + suffix
+        n = 1
+        while unique.casefold() in self.taken:
+            n += 1
+            tag = f"~{n}"
+            unique = name[: 31 - len(suffix) - len(tag)] + tag + suffix
+        if unique != wanted:
+            logging.warning(f"Sheet name {wanted!r} is already taken, using {unique!r}")
+        self.taken.add(unique.casefold())
+        return unique
+
+    def continuation(self, sheetname: str, part: int) -> str:
+        """
+        Name of the `part`-th sheet (from 2) that `sheetname` overflows into:
+        "Name (2)", cutting the name to make room for the suffix (and a "~n" tag).
+        """
+        return self.dedupe(sheetname, f" ({part})")
+
+    @property
+    def changed(self) -> bool:
+        return any(raw != name for raw, name in self.names.items())
+
+
+def resolve_sheetnames(sheetnames) -> dict[str, str]:
+    """
+    Map each of the distinct `sheetnames` (in order) to its unique Excel sheet name.
+    """
+    resolver = SheetNameResolver()
+    return {raw: resolver(raw) for raw in sheetnames}
@@ -1,12 +1,27 @@
+import cProfile
+import glob
 import logging
 import os
 import pathlib
+import stat
 import sys
+import time
 
 import click
 
-from .creators import create_xl_from_df
-from .utils import df_from_clargs
+# pandas and xlsxwriter are only imported once a conversion runs, so that `--help` and
+# argument errors come back straight away
+from .options import (
+    ENGINES,
+    FORMULA_MODES,
+    INPUT_FORMATS,
+    MAX_CONNECTIONS,
+    MAX_INDEX_URLS,
+    MAX_SHEET_ROWS,
+    MIN_SHEET_ROWS,
+    SUBTOTAL_MODES,
+)
+from .profiling import NULL_PROFILER, Profiler
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,9 +38,128 @@ logging.basicConfig(
     default=os.path.join("outputs"),
 )
 @click.option("--output_filename", "-n", required=False, default=r"output.xlsx")
-def run(input_csv_path: str, output_folder: str, output_filename: str) -> None:
+@click.option(
+    "--streaming",
+    is_flag=True,
+    default=False,
+    help="Write rows in order and flush them to disk as they go (constant memory).",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes used to lay out and write sheets.",
+)
+@click.option(
+    "--cache-dir",
+    required=False,
+    type=click.Path(file_okay=False),
+    help="Reuse sheets whose rows are unchanged since a previous run with this cache.",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Rebuild (incrementally) whenever the input CSV changes.",
+)
+@click.option(
+    "--formulas",
+    type=click.Choice(FORMULA_MODES),
+    default="offset",
+    help="'index' writes non-volatile INDEX lookups that recalculate much faster.",
+)
+@click.option(
+    "--max-rows",
+    type=click.IntRange(min=MIN_SHEET_ROWS, max=MAX_SHEET_ROWS),
+    default=MAX_SHEET_ROWS,
+    help="Rows per worksheet; longer sheets continue on 'Name (2)' and so on "
+    "(default: Excel's limit).",
+)
+@click.option(
+    "--max-index-links",
+    type=click.IntRange(min=0, max=MAX_INDEX_URLS),
+    default=MAX_INDEX_URLS,
+    help="Hyperlinks on the Index sheet; entries past this many are HYPERLINK "
+    "formulas (default: Excel's limit).",
+)
+@click.option(
+    "--subtotals",
+    type=click.Choice(SUBTOTAL_MODES),
+    default="none",
+    help="Write each group's subtotals (and the sheet total) on its row, as values or "
+    "as SUM formulas.",
+)
+@click.option(
+    "--input-format",
+    type=click.Choice(sorted(set(INPUT_FORMATS.values()))),
+    default=None,
+    help="Format of the input file (default: from its extension, else csv).",
+)
+@click.option(
+    "--csv-engine",
+    type=click.Choice(["c", "pyarrow"]),
+    default="c",
+    help="CSV parser; pyarrow is multithreaded.",
+)
+@click.option(
+    "--column",
+    "-c",
+    "columns",
+    multiple=True,
+    help="Only read this column (repeat for each column, sheet column first).",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(ENGINES),
+    default="pandas",
+    help="'csv' streams the CSV without pandas, using less memory on large inputs "
+    "(CSV input only). 'polars' reads and groups the input with Polars, on several "
+    "threads. Neither supports --workers, --cache-dir or --float32.",
+)
+@click.option(
+    "--float32",
+    is_flag=True,
+    default=False,
+    help="Hold scenario values as 32-bit floats: half the memory, about 7 significant "
+    "digits. pandas engine only.",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    required=False,
+    type=click.Path(dir_okay=False),
+    help="Write the time, memory, rows and cells of each stage and sheet as JSON here.",
+)
+@click.option(
+    "--cprofile",
+    "cprofile_path",
+    required=False,
+    type=click.Path(dir_okay=False),
+    help="Dump cProfile stats of the conversion here (read with pstats or snakeviz).",
+)
+def run(
+    input_csv_path: str,
+    output_folder: str,
+    output_filename: str,
+    streaming: bool,
+    workers: int,
+    cache_dir: str | None,
+    watch: bool,
+    formulas: str,
+    max_rows: int,
+    max_index_links: int,
+    subtotals: str,
+    input_format: str | None,
+    csv_engine: str,
+    columns: tuple[str, ...],
+    engine: str,
+    float32: bool,
+    profile_path: str | None,
+    cprofile_path: str | None,
+) -> None:
     """
-    INPUT_CSV_PATH: relative path to the CSV file to be converted
+    INPUT_CSV_PATH: relative path to the CSV (or Parquet, Feather or Arrow) file to be
+    converted
     """
 
     if "/" in output_folder or "\\" in output_folder:
@@ -38,6 +172,16 @@ def run(input_csv_path: str, output_folder: str, output_filename: str) -> None:
         click.echo("Please supply a file name only, not a path")
         sys.exit()
 
+    if engine != "pandas" and (workers > 1 or cache_dir is not None or float32):
+        click.echo(
+            f"--engine {engine} doesn't support --workers, --cache-dir or --float32"
+        )
+        sys.exit()
+
+    if engine == "csv" and input_format not in (None, "csv"):
+        click.echo("--engine csv reads CSV files only")
+        sys.exit()
+
     if not os.path.exists(output_folder):
         click.echo(f"Creating output folder: {output_folder}")
         os.mkdir(output_folder)
@@ -48,5 +192,308 @@ def run(input_csv_path: str, output_folder: str, output_filename: str) -> None:
 
     output_excel_path = os.path.join(output_folder, output_filename)
 
+    # watching without a cache would rebuild every sheet on every change
+    if watch and cache_dir is None and engine == "pandas":
+        cache_dir = os.path.join(output_folder, ".cache")
+    cache = None
+    if cache_dir is not None:
+        from .cache import SheetCache
+
+        cache = SheetCache(cache_dir)
+
+    def convert() -> None:
+        profiler = Profiler() if profile_path is not None else NULL_PROFILER
+        hot_path = cProfile.Profile() if cprofile_path is not None else None
+        if hot_path is not None:
+            hot_path.enable()
+
+        if engine == "csv":
+            from .csv_engine import create_xl_from_csv
+
+            create_xl_from_csv(
+                input_csv_path,
+                output_excel_path,
+                streaming=streaming,
+                formula_mode=formulas,
+                profiler=profiler,
+                columns=list(columns) or None,
+                max_sheet_rows=max_rows,
+                max_index_urls=max_index_links,
+                subtotals=subtotals,
+            )
+        elif engine == "polars":
+            from .polars_engine import create_xl_from_polars
+
+            suffix = pathlib.Path(input_csv_path).suffix.lower()
+            create_xl_from_polars(
+                input_csv_path,
+                output_excel_path,
+                input_format=input_format or INPUT_FORMATS.get(suffix, "csv"),
+                streaming=streaming,
+                formula_mode=formulas,
+                profiler=profiler,
+                columns=list(columns) or None,
+                max_sheet_rows=max_rows,
+                max_index_urls=max_index_links,
+                subtotals=subtotals,
+            )
+        else:
+            from .creators import create_xl_from_df
+            from .utils import df_from_clargs
+
+            with profiler.stage("df_from_clargs") as record:
+                input_df = df_from_clargs(
+                    input_csv_path, input_format, csv_engine, list(columns) or None
+                )
+                record["rows"] = len(input_df)
+            create_xl_from_df(
+                input_df,
+                output_excel_path,
+                streaming=streaming,
+                workers=workers,
+                cache=cache,
+                formula_mode=formulas,
+                profiler=profiler,
+                scenario_dtype="float32" if float32 else "float64",
+                max_sheet_rows=max_rows,
+                max_index_urls=max_index_links,
+                subtotals=subtotals,
+            )
+
+        if hot_path is not None:
+            hot_path.disable()
+            hot_path.dump_stats(cprofile_path)
+            logging.info(f"cProfile stats written to {cprofile_path}")
+        if profile_path is not None:
+            profiler.write_report(
+                profile_path,
+                input_path=input_csv_path,
+                output_path=output_excel_path,
+                output_bytes=os.path.getsize(output_excel_path),
+            )
+            logging.info(f"Profile written to {profile_path}")
+
+    convert()
+    if watch:
+        watch_file(input_csv_path, convert)
+
+
+def watch_file(path: str, callback, interval: float = 1.0) -> None:
+    """
+    Call `callback` whenever the modification time of `path` changes, until interrupted.
+    A failing `callback` (e.g. on a half-saved file) is logged and watching carries on.
+    """
+    click.echo(f"Watching {path} for changes (Ctrl+C to stop)")
+    last_mtime = os.stat(path).st_mtime_ns
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if mtime == last_mtime:
+                continue
+
+            last_mtime = mtime
+            try:
+                callback()
+            except Exception:
+                logging.exception(f"Rebuild after change to {path} failed")
+    except KeyboardInterrupt:
+        pass
+
+
+def collect_inputs(inputs: tuple[str, ...], manifest: str | None) -> list[str]:
+    """
+    Expand directories (their *.csv files) and glob patterns in `inputs`, and add the
+    paths listed one per line in `manifest` (blank lines and # comments are skipped).
+    """
+    items = list(inputs)
+    if manifest is not None:
+        with open(manifest) as f:
+            lines = [line.strip() for line in f]
+        items += [line for line in lines if line and not line.startswith("#")]
+
+    paths = []
+    for item in items:
+        if os.path.isdir(item):
+            paths += sorted(glob.glob(os.path.join(item, "*.csv")))
+        elif glob.has_magic(item):
+            paths += sorted(glob.glob(item))
+        else:
+            paths.append(item)
+    return list(dict.fromkeys(paths))
+
+
+# convert one file in a batch worker, returns the time taken
+def convert_csv(input_csv_path: str, output_excel_path: str, streaming: bool) -> float:
+    from .creators import create_xl_from_df
+    from .utils import df_from_clargs
+
+    start = time.perf_counter()
     input_df = df_from_clargs(input_csv_path)
-    create_xl_from_df(input_df, output_excel_path)
+    create_xl_from_df(input_df, output_excel_path, streaming=streaming)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.argument("inputs", nargs=-1)
+@click.option(
+    "--manifest",
+    "-m",
+    required=False,
+    type=click.Path(exists=True, dir_okay=False),
+    help="File listing one input CSV path per line.",
+)
+@click.option(
+    "--output_folder",
+    "-o",
+    required=False,
+    default=os.path.join("outputs"),
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    help="Number of files converted at once.",
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    default=False,
+    help="Write rows in order and flush them to disk as they go (constant memory).",
+)
+def batch(
+    inputs: tuple[str, ...],
+    manifest: str | None,
+    output_folder: str,
+    jobs: int,
+    streaming: bool,
+) -> None:
+    """
+    INPUTS: CSV files, directories of CSV files or glob patterns to be converted.
+    Each CSV is written to OUTPUT_FOLDER under its own name with an .xlsx extension.
+    """
+
+    input_paths = collect_inputs(inputs, manifest)
+    if not input_paths:
+        click.echo("No input CSV files found")
+        sys.exit(1)
+
+    output_paths = {
+        path: os.path.join(output_folder, pathlib.Path(path).stem + ".xlsx")
+        for path in input_paths
+    }
+    if len(set(output_paths.values())) != len(output_paths):
+        click.echo("Some inputs share a file name and would overwrite each other")
+        sys.exit(1)
+
+    if not os.path.exists(output_folder):
+        click.echo(f"Creating output folder: {output_folder}")
+        os.makedirs(output_folder)
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # one bad file is reported, the rest carry on
+    failures = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(convert_csv, path, output_paths[path], streaming): path
+            for path in input_paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                failures[path] = e
+                click.echo(f"FAILED {path}: {type(e).__name__}: {e}")
+            else:
+                click.echo(f"ok     {path} -> {output_paths[path]} ({seconds:.2f}s)")
+
+    elapsed = time.perf_counter() - start
+    n_ok = len(input_paths) - len(failures)
+    click.echo(f"{n_ok} of {len(input_paths)} files converted in {elapsed:.2f}s")
+    if failures:
+        sys.exit(1)
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", "-p", default=8000, help="Port to listen on.")
+@click.option(
+    "--socket",
+    "socket_path",
+    required=False,
+    type=click.Path(dir_okay=False),
+    help="Listen on this Unix socket instead of a TCP port.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    help="Number of conversions run at once.",
+)
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=0),
+    default=16,
+    help="Uploads waiting for a free worker before new ones are turned away (503).",
+)
+@click.option(
+    "--max-connections",
+    type=click.IntRange(min=1),
+    default=MAX_CONNECTIONS,
+    help="Connections served at once; more are turned away (503).",
+)
+@click.option(
+    "--max-upload-mb",
+    type=click.FloatRange(min=0),
+    default=512,
+    help="Largest CSV upload accepted.",
+)
+def serve(
+    host: str,
+    port: int,
+    socket_path: str | None,
+    jobs: int,
+    queue_size: int,
+    max_connections: int,
+    max_upload_mb: float,
+) -> None:
+    """
+    Keep a pool of warm workers running and convert CSVs sent over HTTP.
+    POST a CSV to /convert (optionally ?formulas=index&name=out.xlsx) to get the xlsx
+    back. GET /metrics reports queue depth, request counts and latencies.
+    """
+    # a socket left behind by an earlier run is replaced, anything else is left alone
+    if socket_path is not None and os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            click.echo(f"{socket_path} exists and is not a socket")
+            sys.exit()
+        os.remove(socket_path)
+
+    from .server import (
+        ConversionServer,
+        ConversionService,
+        UnixConversionServer,
+        run_server,
+    )
+
+    service = ConversionService(jobs, queue_size)
+    max_upload_bytes = int(max_upload_mb * 2**20)
+    if socket_path is not None:
+        server = UnixConversionServer(
+            socket_path, service, max_upload_bytes, max_connections
+        )
+        run_server(server, socket_path)
+        os.remove(socket_path)
+    else:
+        server = ConversionServer(
+            (host, port), service, max_upload_bytes, max_connections
+        )
+        run_server(server, f"http://{host}:{server.server_port}")
@@ -1,40 +1,13 @@
-# https://stackoverflow.com/questions/23499017/know-the-depth-of-a-dictionary
 import functools
 import logging
-import operator
-import re
+import pathlib
 
+import numpy as np
 import pandas as pd
 
-
-# infinite dict class
-class NestedDict(dict):
-    def __getitem__(self, key):
-        if key in self:
-            return self.get(key)
-        else:
-            value = NestedDict()
-            self[key] = value
-            return value
-
-
-def dict_depth(d) -> int:
-    """
-    Calculates the depth of the dictionary, `d`
-    """
-    if isinstance(d, dict):
-        return 1 + (max(map(dict_depth, d.values())) if d else 0)
-    return 0
-
-
-def vals_are_lists(d: NestedDict) -> bool:
-    """
-    check whether the values (not the keys) in the dictionary `d` are lists
-    """
-    for key, value in d.items():
-        if not isinstance(value, list):
-            return False
-    return True
+from .options import INPUT_FORMATS
+from .schema import NestedDict, Schema, nest_groups, run_bounds
+from .sheetnames import SheetNameResolver
 
 
 def compose(*functions):
@@ -63,11 +36,7 @@ def get_groups(df: pd.DataFrame) -> list[str]:
     Get all column names in `df` which don't contain a year (ie. 2049).
     Should return all columns besides those with names of scenarios.
     """
-    allcols = list(df.columns)
-    groupnames = [
-        name for name in allcols if not re.search("(19|[2-9][0-9])\d{2}", name)
-    ]
-    return groupnames
+    return Schema.from_columns(df.columns).groupnames
 
 
 def drop_rows_containing(df: pd.DataFrame, string: str) -> pd.DataFrame:
@@ -79,97 +48,183 @@ def drop_rows_containing(df: pd.DataFrame, string: str) -> pd.DataFrame:
     return df.drop(indices)
 
 
-def df_from_clargs(input_csv_path: str) -> pd.DataFrame:
-    """
-    Read command-line args and:
-    + set the output excel file path
-    + read the input csv as a pandas DataFrame
-    """
-    input_df = pd.read_csv(input_csv_path)
+def read_arrow_ipc(input_path: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read an Arrow IPC file, in either the file (random access) or the stream format.
+    """
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    with pa.memory_map(input_path) as source:
+        try:
+            table = pa.ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            source.seek(0)
+            table = pa.ipc.open_stream(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+def df_from_clargs(
+    input_csv_path: str,
+    input_format: str | None = None,
+    csv_engine: str = "c",
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Read the input file as a pandas DataFrame. `input_format` is one of the values of
+    `INPUT_FORMATS`, picked from the file extension if not given (CSV if unknown).
+    `csv_engine` is passed to `pd.read_csv` ("pyarrow" parses on several threads).
+    Only `columns`, in that order, are read if given.
+    Parquet, Feather and Arrow files need pyarrow installed.
+    """
+    if input_format is None:
+        suffix = pathlib.Path(input_csv_path).suffix.lower()
+        input_format = INPUT_FORMATS.get(suffix, "csv")
+
+    if input_format == "csv":
+        input_df = pd.read_csv(input_csv_path, engine=csv_engine, usecols=columns)
+    elif input_format == "parquet":
+        input_df = pd.read_parquet(input_csv_path, columns=columns)
+    elif input_format == "feather":
+        input_df = pd.read_feather(input_csv_path, columns=columns)
+    elif input_format == "arrow":
+        input_df = read_arrow_ipc(input_csv_path, columns)
+    else:
+        raise ValueError(f"Unknown input format {input_format!r}")
+
+    # `usecols` keeps the file's column order, the first column has to be the sheet names
+    if columns is not None:
+        input_df = input_df[columns]
 
     return input_df
 
 
-def get_scenarios(df: pd.DataFrame) -> list[str]:
+def get_scenarios(df: pd.DataFrame, schema: Schema | None = None) -> list[str]:
     """
     Get non-empty data for scenarios - for use in writing excel rows.
     Will ignore empty scenarios only containing ' '
     """
-    groups = get_groups(df)
-    scen_cols = list(df.columns)
-    for group in groups:
-        scen_cols.remove(group)
-    scen_data = [list(df.get(col)) for col in scen_cols]
-    scen_sets = [set(d) for d in scen_data]
-    nonempty_scens = [col for col, s in zip(scen_cols, scen_sets) if len(s) > 1]
-    return nonempty_scens
+    if schema is None:
+        schema = Schema.from_columns(df.columns)
+    return schema.nonempty_scenarios(df)
+
 
+# dtypes scenario values can be held in, see `normalize_columns`
+SCENARIO_DTYPES = ("float64", "float32")
 
-def df_to_dict(in_df: pd.DataFrame) -> NestedDict:
+
+def normalize_columns(
+    in_df: pd.DataFrame, schema: Schema, scenario_dtype: str = "float64"
+) -> pd.DataFrame:
     """
-    Convert `in_df` to NestedDict structure.
+    Copy of `in_df` with blanks in the sheet, grouping and leaf columns filled with ""
+    and those columns stored as categoricals (so repeated labels are stored once), and
+    the scenario columns as `scenario_dtype` floats. Missing or non-numeric scenario
+    values stay NaN; they're written as blank cells.
+    """
+    columns = {
+        name: in_df[name].fillna("").astype("category") for name in schema.groupnames
+    }
+    for name in schema.scenario_cols:
+        values = pd.to_numeric(in_df[name], errors="coerce")
+        columns[name] = values.astype(scenario_dtype)
+    return pd.DataFrame(columns, index=in_df.index)[list(in_df.columns)]
+
+
+def group_slices(
+    in_df: pd.DataFrame, groupnames: list[str]
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Label each row of `in_df` with the group it belongs to in `groupnames` (in order of
+    first appearance) and return the row order that makes each group contiguous, along
+    with the `starts` and `stops` of every group within that order.
+    """
+    grouped = in_df.groupby(groupnames, sort=False, dropna=False, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    order = np.argsort(codes, kind="stable")
+    starts, stops = run_bounds(codes[order])
+    return order, starts, stops
+
+
+def df_to_dict(
+    in_df: pd.DataFrame,
+    schema: Schema | None = None,
+    scenarionames: list[str] | None = None,
+) -> NestedDict:
+    """
+    Convert `in_df` to NestedDict structure, with the values of `scenarionames` (by
+    default the non-empty scenarios) at the leaves.
     """
     # create emtpy infinite dict to fill
     big_dict = NestedDict()
-    groupnames = get_groups(in_df)
-    scenarionames = get_scenarios(in_df)
-    # fill the dict with values from `input_df`
-    for i, row in in_df.iterrows():
-        dim_name = row.Mode
-        scenario_data = row[scenarionames].to_list()
-        upd_d = {dim_name: scenario_data}
+    if in_df.empty:
+        return big_dict
+
+    if schema is None:
+        schema = Schema.from_columns(in_df.columns)
+    if scenarionames is None:
+        scenarionames = schema.nonempty_scenarios(in_df)
+    *branchnames, leafname = schema.groupnames
 
-        # create call to dict: ie. dict[group1][group2]...[groupn]
-        gbrackets = [f"[row[{group!r}]]" for group in groupnames]
-        dict_accessor = "big_dict" + functools.reduce(operator.concat, gbrackets[:-1])
-        ex_d = eval(dict_accessor)  # old dictionary, if any
-        new_d = {**ex_d, **upd_d}  # update and create new dictionary
-        dict_set = dict_accessor + " = new_d"  # expression to assign old dict to new
-        exec(dict_set)  # execute dict_set
+    # sort once so that each innermost group is a contiguous block of rows
+    order, starts, stops = group_slices(in_df, branchnames)
+    branches = in_df[branchnames].to_numpy()[order[starts]]
+    leaves = in_df[leafname].to_numpy()[order]
+    scenario_data = in_df[scenarionames].to_numpy()[order]
 
-    return big_dict
+    return nest_groups(
+        (branch, leaves[start:stop].tolist(), scenario_data[start:stop].tolist())
+        for branch, start, stop in zip(branches.tolist(), starts, stops)
+    )
 
 
 def shorten_long_sheetnames(in_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Shorten the names of sheets to meet excel's 31 character limit.
-    """
-    rlist = [
-        ("Average", "Avg."),
-        ("Distance", "Dist."),
-        ("Distances", "Dists"),
-        ("Terminating", "Term."),
-        ("Originating", "Orig."),
-        ("Population", "Pop."),
-    ]
-
-    def replace_multi(rlist, name):
-        for frm, to in rlist:
-            if len(name) > 31:
-                name = name.replace(frm, to)
-        if len(name) > 31:
-            name = name.replace(" ", "")
-        if len(name) > 31:
-            name = name[0:31]
-        return name
-
+    Shorten the names of sheets to meet excel's 31 character limit, keeping them unique
+    (see `SheetNameResolver`). Each distinct name is resolved once and mapped back onto
+    the rows as a categorical, whose categories are the sheets in order of first
+    appearance.
+    """
     sheetname_col = list(in_df.columns)[0]
-    sheetnames = list(in_df.loc[:, sheetname_col])
-    replaced_sheetnames = [replace_multi(rlist, name) for name in sheetnames]
+    codes, uniques = pd.factorize(in_df[sheetname_col], sort=False)
+    resolver = SheetNameResolver()
+    sheetnames = [resolver(raw) for raw in uniques.tolist()]
 
-    if in_df[sheetname_col].to_list() != replaced_sheetnames:
+    if resolver.changed:
         logging.info("Sheet names shortened to be < 31 chars")
 
-    in_df[sheetname_col] = replaced_sheetnames
+    in_df[sheetname_col] = pd.Categorical.from_codes(codes, categories=sheetnames)
     return in_df
 
 
-def get_sheetnames(in_df: pd.DataFrame) -> set[str]:
+def partition_sheets(
+    in_df: pd.DataFrame, schema: Schema | None = None
+) -> dict[str, pd.DataFrame]:
+    """
+    Split `in_df` into one sub-frame per sheet (in order of first appearance) with a
+    single pass over the sheet column. Rows are only reordered if a sheet's rows aren't
+    already contiguous; each sub-frame is then a slice of the (sorted) frame.
+    """
+    if schema is None:
+        schema = Schema.from_columns(in_df.columns)
+    sheetname_col = schema.sheet_col
+    order, starts, stops = group_slices(in_df, [sheetname_col])
+    if np.any(np.diff(order) != 1):
+        in_df = in_df.iloc[order]
+
+    sheetnames = in_df[sheetname_col].to_numpy()[starts]
+    return {
+        name: in_df.iloc[start:stop]
+        for name, start, stop in zip(sheetnames.tolist(), starts, stops)
+    }
+
+
+def get_sheetnames(in_df: pd.DataFrame) -> list[str]:
     """
-    Get the names of the sheets that will exist in the final excel file.
+    Get the names of the sheets that will exist in the final excel file, in the order
+    they're written.
     """
-    groups = get_groups(in_df)
-    sheetname_col = groups[0]
-    sheetnames = in_df.loc[:, sheetname_col]
-    sheetset = set(sheetnames)
-    return sheetset
+    sheetname_col = Schema.from_columns(in_df.columns).sheet_col
+    return list(pd.unique(in_df[sheetname_col]))
@@ -0,0 +1,843 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING
+
+import numpy as np
+import xlsxwriter
+
+from xlsxwriter.utility import xl_col_to_name, xl_rowcol_to_cell
+from .layout import (
+    BORDERED_STYLES,
+    LABEL_FONTS,
+    RowPlan,
+    add_subtotals,
+    column_widths,
+    comparison_values,
+    split_plan,
+    subtotal_runs,
+)
+from .options import MAX_INDEX_URLS, MAX_SHEET_ROWS
+from .profiling import NULL_PROFILER, Profiler
+from .sheetnames import INDEX_SHEETNAME, SheetNameResolver
+
+if TYPE_CHECKING:
+    from .cache import SheetCache
+
+# Writing the workbook from sheet layouts. Nothing here needs pandas, so the engines that
+# don't build a DataFrame (see `csv_engine`) never import it.
+
+# the sheet's data rows start below the header block
+ROW_OFFSET = 3
+
+# Excel's limits on the arguments of a function, the length of a formula and the length
+# of a text value in a formula
+MAX_FUNCTION_ARGS = 255
+MAX_FORMULA_LENGTH = 8192
+MAX_FORMULA_TEXT = 255
+
+
+def create_format_dict(workbook: xlsxwriter.Workbook, max_indent: int) -> dict:
+    format_dict = {}
+    bordercolor = "#9B9B9B"
+    orangecolor = "#F7D8AA"
+    greycolor = "#F0F0F0"
+
+    format_dict["sheetname"] = workbook.add_format(
+        {
+            "valign": "vcenter",
+            "bg_color": orangecolor,
+            "font_name": "Segoe UI Light (Heading)",
+            "font_size": 14,
+            "bottom": 1,
+            "right": 1,
+            "border_color": bordercolor,
+            "indent": 1,
+        }
+    )
+
+    format_dict["metric"] = workbook.add_format(
+        {
+            "bold": True,
+            "bg_color": greycolor,
+            "valign": "vcenter",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "border": 1,
+            "border_color": bordercolor,
+            "indent": 1,
+        }
+    )
+
+    format_dict["scenario"] = workbook.add_format(
+        {
+            "bold": False,
+            "bg_color": greycolor,
+            "border_color": bordercolor,
+            "align": "centre",
+            "valign": "vcentre",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "top": 1,
+            "bottom": 1,
+            "left": 0,
+            "right": 0,
+        }
+    )
+    format_dict["l_scenario"] = workbook.add_format(
+        {
+            "bold": False,
+            "bg_color": greycolor,
+            "border_color": bordercolor,
+            "align": "centre",
+            "valign": "vcentre",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "top": 1,
+            "bottom": 1,
+            "left": 1,
+            "right": 0,
+        }
+    )
+    format_dict["r_scenario"] = workbook.add_format(
+        {
+            "bold": False,
+            "bg_color": greycolor,
+            "border_color": bordercolor,
+            "align": "centre",
+            "valign": "vcentre",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "top": 1,
+            "bottom": 1,
+            "left": 0,
+            "right": 1,
+        }
+    )
+
+    format_dict["dropdown"] = workbook.add_format(
+        {
+            "bottom": 1,
+            "border_color": bordercolor,
+            "align": "centre",
+            "valign": "vcentre",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "bg_color": "#DAEDF8",
+            "fg_color": "#FFFFFF",
+            "pattern": 16,
+        }
+    )
+
+    format_dict["pformat"] = workbook.add_format(
+        {
+            "bottom": 1,
+            "border_color": bordercolor,
+            "align": "right",
+            "valign": "vcentre",
+            "font_name": "Segoe UI (Body)",
+            "font_size": 8,
+            "bg_color": "#DAEDF8",
+        }
+    )
+
+    format_dict["comp"] = workbook.add_format(
+        {
+            "top": 1,
+            "border_color": bordercolor,
+            "align": "left",
+            "valign": "vcentre",
+            "font_name": "Segoe UI Light (Headings)",
+            "font_size": 8,
+            "bg_color": "#DAEDF8",
+            "indent": 1,
+        }
+    )
+
+    format_dict["lilcell"] = workbook.add_format(
+        {
+            "top": 1,
+            "right": 1,
+            "border_color": bordercolor,
+            "align": "left",
+            "valign": "vcentre",
+            "font_name": "Segoe UI Light (Headings)",
+            "font_size": 8,
+            "bg_color": "#DAEDF8",
+            "indent": 1,
+        }
+    )
+
+    format_dict["r"] = workbook.add_format({"right": 1, "border_color": "#9B9B9B"})
+
+    # one format per label style and indent level a row can have (up to `max_indent`),
+    # so that rows never modify a shared format
+    format_dict["labels"] = {
+        (style, indent): workbook.add_format(
+            {
+                "bold": bold,
+                "font_name": "Segoe UI (Body)",
+                "font_size": size,
+                "right": 1,
+                "border_color": "#9B9B9B",
+                "indent": indent,
+            }
+        )
+        for style, (bold, size) in LABEL_FONTS.items()
+        for indent in range(max_indent + 1)
+    }
+    format_dict["index_group"] = workbook.add_format(
+        {
+            "bold": True,
+            "font_name": "Arial Narrow",
+            "font_size": 11,
+            "font_color": "blue",
+            "underline": 1,
+            "indent": 1,
+        }
+    )
+    format_dict["index_header"] = workbook.add_format(
+        {
+            "bold": True,
+            "bottom": 1,
+            "font_name": "Arial Narrow",
+            "font_size": 16,
+            "indent": 0,
+        }
+    )
+    format_dict["index_ul"] = workbook.add_format({"bottom": 1})
+    format_dict["num"] = workbook.add_format(
+        {"font_name": "Segoe UI (Body)", "font_size": 8, "num_format": "#,##0.000"}
+    )
+    format_dict["pct"] = workbook.add_format(
+        {"font_name": "Segoe UI (Body)", "font_size": 8, "num_format": "0.0%"}
+    )
+    format_dict["l"] = workbook.add_format({"left": 1, "border_color": "#9B9B9B"})
+    format_dict["hidden"] = workbook.add_format({"num_format": ";;;"})
+
+    fix_xf_indices(format_dict)
+    return format_dict
+
+
+def scenario_header_range(n_scenarios: int) -> str:
+    """
+    Absolute reference to the scenario names in row 3, eg. `$G$3:$K$3`.
+    """
+    last_col = xl_col_to_name(6 + n_scenarios - 1)
+    return f"$G$3:${last_col}$3"
+
+
+# function to create the top block of a sheet. Returns nothing. Just alters `workbook` in memory.
+# Rows are written top to bottom so that the block also works in `constant_memory` mode.
+def create_header_block(
+    sheetname: str,
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    workbook: xlsxwriter.workbook.Workbook,
+    scenarionames: list[str],
+    format_dict: dict,
+    formula_mode: str = "offset",
+) -> None:
+    # the scenario columns, G to the last scenario
+    scenario_range = scenario_header_range(len(scenarionames))
+
+    # set height of sheet name cell, and make row 3 vertically taller (48 px)
+    worksheet.set_row_pixels(0, 24)
+    worksheet.set_row_pixels(1, 24)
+    worksheet.set_row_pixels(2, 48)
+
+    # set sheetname and metrics column (A) widths
+    worksheet.set_column("A:A", 34.83)
+
+    # in "index" mode, B1 and C1 hold the position of each chosen scenario (hidden)
+    if formula_mode == "index":
+        for col, position in zip("BC", (1, 2)):
+            worksheet.write_formula(
+                f"{col}1",
+                f"=MATCH({col}$3, {scenario_range}, 0)",
+                format_dict["hidden"],
+                position,
+            )
+
+    # merge cells A1 and A2
+    # write the sheet name in the merged cells, large font, orange cell
+    worksheet.merge_range("A1:A2", sheetname, format_dict["sheetname"])
+
+    # merge cells {B, C, D, E}:2
+    # write 'compare loaded scenarios...' in the merged cells, blue cell
+    worksheet.merge_range(
+        "B2:E2", "Compare two loaded scenarios (use dropdowns)", format_dict["comp"]
+    )
+    worksheet.write("F2", None, format_dict["lilcell"])
+
+    # write 'Metric' in cell A3, bold format, grey background
+    worksheet.write("A3", "Metric", format_dict["metric"])
+
+    # write all scenario* names in {H...}:3
+    scenario_col_offset = 6
+    for offset, name in enumerate(scenarionames):
+        if offset == 0:
+            worksheet.write(
+                2, scenario_col_offset + offset, name, format_dict["l_scenario"]
+            )
+
+        elif offset == len(scenarionames) - 1:
+            worksheet.write(
+                2, scenario_col_offset + offset, name, format_dict["r_scenario"]
+            )
+
+        else:
+            worksheet.write(
+                2, scenario_col_offset + offset, name, format_dict["scenario"]
+            )
+
+    # create dropdowns (validation)
+    input_cell_1 = "B$3"
+    worksheet.data_validation(
+        input_cell_1,
+        {
+            "validate": "list",
+            # 'source': scenarionames,
+            "source": "="
+            + (scenario_range if formula_mode == "index" else "$G$3:$XFD$3"),
+            "input_title": "Pick a scenario",
+        },
+    )
+    worksheet.write(input_cell_1, scenarionames[0], format_dict["dropdown"])
+
+    input_cell_2 = "C$3"
+    worksheet.data_validation(
+        input_cell_2,
+        {
+            "validate": "list",
+            # 'source': scenarionames,
+            "source": "="
+            + (scenario_range if formula_mode == "index" else "$G$3:$XFD$3"),
+            "input_title": "Pick a scenario",
+        },
+    )
+    worksheet.write(input_cell_2, scenarionames[1], format_dict["dropdown"])
+
+    # create +/- headings
+    pmcell = "D$3"
+    worksheet.write(pmcell, "+/-", format_dict["pformat"])
+    pcell = "E$3"
+    worksheet.write(pcell, "%", format_dict["pformat"])
+    worksheet.write("F3", None, format_dict["pformat"])
+
+
+def create_dynamic_block(
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    workbook: xlsxwriter.workbook.Workbook,
+    format_dict: dict,
+) -> None:
+    # make column F small and G zero-width
+    worksheet.set_column("F:F", 2.33, format_dict["r"])
+
+
+def sheet_ref(sheetname: str) -> str:
+    """
+    `sheetname` quoted for use in a reference, eg. `'Sheet 1'` (quotes in the name are
+    doubled).
+    """
+    return "'" + sheetname.replace("'", "''") + "'"
+
+
+def create_index_entries(sheetname: str, plan: RowPlan) -> list[tuple[str, str, str]]:
+    """
+    Work out the Index sheet entries for `sheetname` from its layout, before the sheet is
+    written: a link to the top of the sheet followed by a link to each top-level group.
+    Returns (name, location, format name) tuples.
+    """
+    entries = [(sheetname, f"{sheet_ref(sheetname)}!A1", "index_header")]
+    for name, row in plan.links:
+        to_cell = xl_rowcol_to_cell(row, 0)
+        entries.append((name, f"{sheet_ref(sheetname)}!{to_cell}", "index_group"))
+    return entries
+
+
+def hyperlink_formula(location: str, name: str) -> str:
+    """
+    A `HYPERLINK` formula jumping to `location` in this workbook, showing `name` (cut
+    to the 255 characters a formula's text can hold).
+    """
+    location = location.replace('"', '""')
+    name = name[:MAX_FORMULA_TEXT].replace('"', '""')
+    return f'=HYPERLINK("#{location}", "{name}")'
+
+
+# write a sheet's entries to the index sheet, returns the next free index row
+# The entries are hyperlinks, or with `as_urls` False `HYPERLINK` formulas, which don't
+# count towards a worksheet's limit of 65,530 hyperlinks.
+def write_index_entries(
+    index_sheet: xlsxwriter.worksheet.Worksheet,
+    entries: list[tuple[str, str, str]],
+    format_dict: dict,
+    index_row_offset: int,
+    as_urls: bool = True,
+) -> int:
+    index_row_offset += 1
+    for name, location, format_name in entries:
+        if as_urls:
+            index_sheet.write_url(index_row_offset, 1, f"internal:{location}")
+            index_sheet.write(index_row_offset, 1, name, format_dict[format_name])
+        else:
+            index_sheet.write_formula(
+                index_row_offset,
+                1,
+                hyperlink_formula(location, name),
+                format_dict[format_name],
+                # the text the formula shows
+                name[:MAX_FORMULA_TEXT],
+            )
+        index_row_offset += 1
+    return index_row_offset
+
+
+def sum_formula(col: str, runs: list[tuple[int, int]]) -> str:
+    """
+    A formula adding up column `col` over the (first, last) `runs` of rows, in as many
+    `SUM`s as Excel's limit of 255 arguments per function needs.
+    """
+    refs = [
+        f"{col}{first + 1}" if first == last else f"{col}{first + 1}:{col}{last + 1}"
+        for first, last in runs
+    ]
+    sums = [
+        "SUM(" + ",".join(refs[i : i + MAX_FUNCTION_ARGS]) + ")"
+        for i in range(0, len(refs), MAX_FUNCTION_ARGS)
+    ]
+    return "=" + "+".join(sums)
+
+
+# write the scenario values of a subtotal row as `SUM` formulas over the rows it adds up
+# (see `layout.subtotal_runs`), with `values` as their cached results. Blank values, and
+# formulas too long for Excel, are written as they are.
+def write_subtotal_formulas(
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    row_offset: int,
+    nums_offset: int,
+    runs: list[tuple[int, int]],
+    values: list,
+    cell_format,
+) -> None:
+    for col, value in enumerate(values, nums_offset):
+        formula = sum_formula(xl_col_to_name(col), runs)
+        if value is None or len(formula) > MAX_FORMULA_LENGTH:
+            worksheet.write(row_offset, col, value, cell_format)
+        else:
+            worksheet.write_formula(row_offset, col, formula, cell_format, value)
+
+
+# input the data for each sheet from its layout (see `layout.layout_sheet`)
+# rows are written strictly top to bottom, returns the next free row
+# With `subtotal_formulas`, subtotal rows (see `layout.add_subtotals`) sum their rows with
+# formulas instead of holding static values.
+def create_data_rows(
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    plan: RowPlan,
+    workbook: xlsxwriter.workbook.Workbook,
+    format_dict: dict,
+    formula_mode: str = "offset",
+    subtotal_formulas: bool = False,
+) -> int:
+    nums_offset = 6
+    last_col = xl_col_to_name(nums_offset + plan.values.shape[1] - 1)
+    sum_runs = subtotal_runs(plan) if subtotal_formulas else {}
+
+    # blanks are written as empty (formatted) cells
+    values = plan.values.astype(object)
+    values[np.isnan(plan.values)] = None
+
+    # cached results of the comparison formulas, so they show without a recalculation
+    comparisons = comparison_values(plan.values)
+    results = comparisons.astype(object)
+    results[np.isnan(comparisons)] = "-"
+
+    for i in range(plan.n_rows):
+        row_offset = plan.first_row + i
+        label = plan.labels[i]
+        style = plan.styles[i]
+
+        if label is not None:
+            label_format = format_dict["labels"][style, plan.indents[i]]
+            worksheet.write(row_offset, 0, label, label_format)
+
+        if style in BORDERED_STYLES:
+            worksheet.write(row_offset, nums_offset, None, format_dict["l"])
+
+        if plan.data[i] >= 0:
+            if i in sum_runs:
+                write_subtotal_formulas(
+                    worksheet,
+                    row_offset,
+                    nums_offset,
+                    sum_runs[i],
+                    values[plan.data[i]].tolist(),
+                    format_dict["num"],
+                )
+            else:
+                worksheet.write_row(
+                    row_offset,
+                    nums_offset,
+                    values[plan.data[i]].tolist(),
+                    format_dict["num"],
+                )
+
+            formula_offset = row_offset + 1
+            if formula_mode == "index":
+                # non-volatile lookups into this row's scenarios, using the MATCHes in B1/C1
+                scenario_cells = f"$G{formula_offset}:${last_col}{formula_offset}"
+                formulers = [
+                    f'=IFERROR(INDEX({scenario_cells}, B$1), "-")',
+                    f'=IFERROR(INDEX({scenario_cells}, C$1), "-")',
+                ]
+            else:
+                formulers = [
+                    f'=IFERROR(OFFSET($F{formula_offset}, 0, MATCH(B$3, $G$3:$DB$3, 0)), "-")',
+                    f'=IFERROR(OFFSET($F{formula_offset}, 0, MATCH(C$3, $G$3:$DB$3, 0)), "-")',
+                ]
+            formulers.append(f'=IFERROR(C{formula_offset}-B{formula_offset}, "-")')
+            pct_cell = f'=IFERROR(C{formula_offset}/B{formula_offset}-1, "-")'
+
+            *num_results, pct_result = results[plan.data[i]].tolist()
+            for col, (formula, result) in enumerate(zip(formulers, num_results), 1):
+                worksheet.write_formula(
+                    row_offset, col, formula, format_dict["num"], result
+                )
+            worksheet.write_formula(
+                row_offset, 4, pct_cell, format_dict["pct"], pct_result
+            )
+
+    return plan.first_row + plan.n_rows
+
+
+# fill `worksheet` with the sheet for `plan`: its header block, data rows and column widths
+def fill_sheet(
+    worksheet: xlsxwriter.worksheet.Worksheet,
+    workbook: xlsxwriter.workbook.Workbook,
+    sheetname: str,
+    scenarionames: list[str],
+    plan: RowPlan,
+    format_dict: dict,
+    formula_mode: str = "offset",
+    subtotal_formulas: bool = False,
+) -> None:
+    worksheet.set_default_row(18)
+    worksheet.hide_gridlines(2)
+
+    create_header_block(
+        sheetname,
+        worksheet,
+        workbook,
+        scenarionames,
+        format_dict,
+        formula_mode,
+    )
+    create_dynamic_block(worksheet, workbook, format_dict)
+    create_data_rows(
+        worksheet, plan, workbook, format_dict, formula_mode, subtotal_formulas
+    )
+
+    worksheet.set_default_row(hide_unused_rows=True)
+
+    # setting column widths
+    widths = column_widths(len(scenarionames), full_width=formula_mode != "index")
+    for columns, width in widths:
+        worksheet.set_column(columns, width)
+
+
+# add and fill the sheet for `plan`, and its entries on the index sheet (as hyperlinks,
+# or `HYPERLINK` formulas if not `index_urls`), returns the next free index row
+def write_sheet(
+    workbook: xlsxwriter.workbook.Workbook,
+    sheetname: str,
+    scenarionames: list[str],
+    plan: RowPlan,
+    format_dict: dict,
+    index_sheet: xlsxwriter.worksheet.Worksheet,
+    index_row_offset: int,
+    formula_mode: str = "offset",
+    index_urls: bool = True,
+    subtotal_formulas: bool = False,
+) -> int:
+    worksheet = workbook.add_worksheet(sheetname)
+
+    index_entries = create_index_entries(sheetname, plan)
+    index_row_offset = write_index_entries(
+        index_sheet, index_entries, format_dict, index_row_offset, index_urls
+    )
+
+    fill_sheet(
+        worksheet,
+        workbook,
+        sheetname,
+        scenarionames,
+        plan,
+        format_dict,
+        formula_mode,
+        subtotal_formulas,
+    )
+    return index_row_offset
+
+
+# Writes the XML of the sheet for `plan` to `path`, for `write_workbook` to copy into
+# the workbook (run in worker processes, or in this one to fill a `SheetCache`). The
+# sheet is filled in a throwaway workbook with the same formats, so its cells refer to
+# the same styles (see `fix_xf_indices`), and in `constant_memory` mode, which writes
+# strings inline rather than to the workbook's shared strings. The XML goes to a
+# temporary file first, so `path` never holds half a sheet.
+def render_sheet(
+    path: str,
+    sheetname: str,
+    scenarionames: list[str],
+    plan: RowPlan,
+    max_indent: int,
+    formula_mode: str = "offset",
+    subtotal_formulas: bool = False,
+) -> None:
+    workbook = xlsxwriter.Workbook(
+        path, {"constant_memory": True, "tmpdir": os.path.dirname(path)}
+    )
+    format_dict = create_format_dict(workbook, max_indent)
+    worksheet = workbook.add_worksheet(sheetname)
+    fill_sheet(
+        worksheet,
+        workbook,
+        sheetname,
+        scenarionames,
+        plan,
+        format_dict,
+        formula_mode,
+        subtotal_formulas,
+    )
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    save_sheet_xml(worksheet, tmp_path)
+    os.replace(tmp_path, path)
+
+
+# The xlsxwriter internals sheets written by other processes rely on, as of xlsxwriter
+# 3.1 to 3.2 (tests/test_writer.py checks that they still add up to the same workbook):
+# `Format._get_xf_index` gives a format its index in the style table, the first time
+# it's called; `Packager._write_worksheet_files` flushes a `constant_memory` sheet's last
+# row and writes its XML with `_set_xml_writer` and `_assemble_xml_file`.
+
+
+# give every format its index in the style table up front, in the order they were made,
+# rather than in the order cells first use them, so that any workbook made by
+# `create_format_dict` numbers them the same
+def fix_xf_indices(format_dict: dict) -> None:
+    for name, cell_format in format_dict.items():
+        for cell_format in cell_format.values() if name == "labels" else [cell_format]:
+            cell_format._get_xf_index()
+
+
+# write the XML of `worksheet`, whose workbook is never closed, to `path`
+def save_sheet_xml(worksheet: xlsxwriter.worksheet.Worksheet, path: str) -> None:
+    worksheet._opt_reopen()
+    worksheet._write_single_row()
+    worksheet._set_xml_writer(path)
+    worksheet._assemble_xml_file()
+
+
+class PrewrittenWorksheet(xlsxwriter.worksheet.Worksheet):
+    """
+    A worksheet whose XML `render_sheet` has written to `part_path`, copied in when the
+    workbook is closed.
+    """
+
+    part_path = None
+
+    def _assemble_xml_file(self) -> None:
+        with open(self.part_path, encoding="utf-8") as part:
+            shutil.copyfileobj(part, self.fh)
+        self._xml_close()
+        # (in `constant_memory` mode the sheet also has a file for rows, left empty)
+        if self.row_data_fh is not None:
+            self.row_data_fh.close()
+            os.remove(self.row_data_filename)
+
+
+# Drops `fullCalcOnLoad` from the workbook's calcPr, which xlsxwriter writes in every
+# calc mode but "manual" and has no public option for. This sets the attribute
+# `Workbook._write_calc_pr` checks, `calc_on_load` in xlsxwriter 3.1 to 3.2; if a later
+# version drops it, Excel just recalculates on load as before (see tests/test_writer.py).
+def skip_full_calc_on_load(workbook: xlsxwriter.Workbook) -> None:
+    if hasattr(workbook, "calc_on_load"):
+        workbook.calc_on_load = False
+    else:
+        logging.debug("xlsxwriter has no calc_on_load, workbooks recalculate on load")
+
+
+# Writes the sheets prepared by `prepared` (in the order of `sheet_rows`, which maps each
+# sheet name to its number of input rows) to a new workbook at `excel_out_path`.
+# `excel_out_path` may also be a binary file object (see `api.write_xlsx`).
+# Sheets are prepared lazily, one at a time, as they're written. A sheet with more rows
+# than `max_sheet_rows` is split at group boundaries into continuation sheets, "Name (2)"
+# and so on, each with its own header block and Index entries (see `layout.split_plan`).
+# The Index sheet links to each sheet with hyperlinks, up to `max_index_urls` of them;
+# entries past that are `HYPERLINK` formulas, which Excel doesn't limit.
+# `subtotals` "values" writes each group's subtotals (and the sheet total) on its row, see
+# `layout.add_subtotals`; "formulas" writes them as SUM formulas, with cached results.
+# With a process `pool`, the sheets are written to XML by the pool (see `render_sheet`)
+# while this process lays out the next ones; closing the workbook only copies them in.
+# With a `cache`, the XML is kept there, and sheets whose XML is already cached aren't
+# written again.
+def write_workbook(
+    excel_out_path,
+    sheet_rows: dict[str, int],
+    prepared: Iterator[tuple[list[str], RowPlan]],
+    max_indent: int,
+    streaming: bool = False,
+    formula_mode: str = "offset",
+    profiler: Profiler = NULL_PROFILER,
+    max_sheet_rows: int = MAX_SHEET_ROWS,
+    max_index_urls: int = MAX_INDEX_URLS,
+    subtotals: str = "none",
+    pool: Executor | None = None,
+    cache: "SheetCache | None" = None,
+) -> None:
+    # a file object is written from memory, without temporary files (except when
+    # streaming, which needs them)
+    to_file_object = not isinstance(excel_out_path, (str, os.PathLike))
+    workbook = xlsxwriter.Workbook(
+        excel_out_path,
+        {"constant_memory": streaming, "in_memory": to_file_object and not streaming},
+    )
+
+    # every formula is written with its result, so Excel doesn't need to recalculate the
+    # whole workbook when it's opened (the calc id is Excel 2019 / 365's)
+    workbook.set_calc_mode("auto", calc_id=191029)
+    skip_full_calc_on_load(workbook)
+
+    # create the index sheet
+    workbook.add_worksheet(INDEX_SHEETNAME)
+
+    # create a dict of formats used in the workbook
+    format_dict = create_format_dict(workbook, max_indent)
+
+    index_sheet = workbook.get_worksheet_by_name(INDEX_SHEETNAME)
+
+    index_row_offset = 0
+
+    # continuation sheets get names no other sheet has
+    resolver = SheetNameResolver(reserved=(INDEX_SHEETNAME, *sheet_rows))
+
+    # hyperlinks left before the index switches to `HYPERLINK` formulas
+    urls_left = max_index_urls
+
+    with contextlib.ExitStack() as stack:
+        # the sheets being written by the pool, and the directory for their XML
+        rendered = []
+        prewritten = pool is not None or cache is not None
+        if prewritten and cache is None:
+            parts_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        for idx, (sheetname, n_input_rows) in enumerate(sheet_rows.items()):
+            # with `workers` > 1 this is mostly waiting for the pool
+            with profiler.stage("prepare_sheet", sheetname) as record:
+                scenarionames, plan = next(prepared)
+                record["input_rows"] = n_input_rows
+
+            logging.info(f"creating {sheetname} sheet")
+            logging.info(f"(Creating {idx+1} of {len(sheet_rows)} total sheets)")
+
+            if subtotals != "none":
+                with profiler.stage("add_subtotals", sheetname):
+                    plan = add_subtotals(plan)
+
+            parts = split_plan(plan, sheetname, max_sheet_rows)
+            if len(parts) > 1:
+                logging.info(
+                    f"{sheetname} has too many rows, split into {len(parts)} sheets"
+                )
+
+            for n, part in enumerate(parts, 1):
+                if n > 1:
+                    partname = resolver.continuation(sheetname, n)
+                else:
+                    partname = sheetname
+                # (one entry for the sheet, one for each top-level group)
+                n_entries = 1 + len(part.links)
+                index_urls = n_entries <= urls_left
+                urls_left = urls_left - n_entries if index_urls else 0
+
+                if prewritten:
+                    stage = "write_sheet" if pool is None else "queue_sheet"
+                    with profiler.stage(stage, partname) as record:
+                        worksheet = workbook.add_worksheet(
+                            partname, worksheet_class=PrewrittenWorksheet
+                        )
+                        if cache is None:
+                            worksheet.part_path = os.path.join(
+                                parts_dir, f"sheet{worksheet.index}.xml"
+                            )
+                        else:
+                            key = cache.part_key(
+                                partname,
+                                scenarionames,
+                                part,
+                                max_indent,
+                                formula_mode,
+                                subtotals,
+                            )
+                            worksheet.part_path = cache.part_path(key)
+                        record["cached"] = os.path.exists(worksheet.part_path)
+                        args = (
+                            worksheet.part_path,
+                            partname,
+                            scenarionames,
+                            part,
+                            max_indent,
+                            formula_mode,
+                            subtotals == "formulas",
+                        )
+                        if record["cached"]:
+                            logging.debug(f"reusing the cached XML of {partname}")
+                        elif pool is None:
+                            render_sheet(*args)
+                        else:
+                            rendered.append(pool.submit(render_sheet, *args))
+                        index_row_offset = write_index_entries(
+                            index_sheet,
+                            create_index_entries(partname, part),
+                            format_dict,
+                            index_row_offset,
+                            index_urls,
+                        )
+                        record["rows"] = part.n_rows
+                        record["cells"] = part.n_cells
+                    continue
+
+                with profiler.stage("write_sheet", partname) as record:
+                    index_row_offset = write_sheet(
+                        workbook,
+                        partname,
+                        scenarionames,
+                        part,
+                        format_dict,
+                        index_sheet,
+                        index_row_offset,
+                        formula_mode,
+                        index_urls,
+                        subtotals == "formulas",
+                    )
+                    record["rows"] = part.n_rows
+                    record["cells"] = part.n_cells
+            logging.info(f"{sheetname} sheet done")
+
+        if rendered:
+            with profiler.stage("render_sheets") as record:
+                for future in rendered:
+                    future.result()
+                record["sheets"] = len(rendered)
+
+        logging.info(f"Writing excel file to {excel_out_path}")
+        index_sheet.set_column("B:B", 33.33)
+        index_sheet.hide_gridlines(2)
+        with profiler.stage("workbook.close"):
+            workbook.close()
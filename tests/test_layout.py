@@ -0,0 +1,108 @@
+import random
+
+import numpy as np
+import pytest
+
+from excelcreator.layout import (
+    STYLE_BLANK,
+    add_subtotals,
+    layout_sheet,
+    split_plan,
+    subtotal_runs,
+)
+
+FIRST_ROW = 3
+
+# the rows of `--subtotals formulas --max-rows 7` that once left a stale SUM on 'S (2)'
+SPLIT_GROUP = {
+    "S": {"A": {"--": {"m1": [1, 2], "m2": [3, 4]}, "x": {"m1": [100, 200]}}}
+}
+
+
+def random_group(rng: random.Random, depth: int, level: int = 1) -> dict:
+    """
+    A random nested dict as `df_to_dict` builds them, with "--" rows and blanks.
+    """
+    if depth == 0 or (level > 1 and rng.random() < 0.3):
+        leaves = {}
+        if rng.random() < 0.2:
+            leaves["--"] = [rng.randint(1, 9), rng.randint(1, 9)]
+        for i in range(rng.randint(1, 3)):
+            leaves[f"m{i}"] = [rng.choice([None, 1, 2, 5]), rng.randint(1, 9)]
+        return leaves
+    group = {}
+    for i in range(rng.randint(1, 3)):
+        name = "--" if level > 1 and i == 0 and rng.random() < 0.2 else f"g{level}{i}"
+        group[name] = random_group(rng, depth - 1, level + 1)
+    return group
+
+
+def random_plans(n: int):
+    rng = random.Random(0)
+    for _ in range(n):
+        sheet_dict = {"S": random_group(rng, rng.randint(1, 3))}
+        yield layout_sheet(sheet_dict, FIRST_ROW, 2), rng.randint(6, 12)
+
+
+def test_split_subtotal_formulas_match_values():
+    plans = [(layout_sheet(SPLIT_GROUP, FIRST_ROW, 2), 7), *random_plans(200)]
+    for plan, max_rows in plans:
+        for part in split_plan(add_subtotals(plan), "S", max_rows):
+            for group, runs in subtotal_runs(part).items():
+                rows = np.concatenate(
+                    [np.arange(first, last + 1) for first, last in runs]
+                )
+                # what the SUM formulas work out to, blanks counting as nothing
+                sums = np.nansum(part.values[part.data[rows - FIRST_ROW]], axis=0)
+                cached = part.values[part.data[group]]
+                known = ~np.isnan(cached)
+                assert sums[known] == pytest.approx(cached[known])
+
+
+def data_rows(part) -> int:
+    return int(np.count_nonzero(part.data >= 0))
+
+
+def test_split_fits():
+    plan = layout_sheet(SPLIT_GROUP, FIRST_ROW, 2)
+    assert split_plan(plan, "S", FIRST_ROW + plan.n_rows) == [plan]
+
+
+def test_split_no_room():
+    plan = layout_sheet(SPLIT_GROUP, FIRST_ROW, 2)
+    with pytest.raises(ValueError):
+        split_plan(plan, "S", FIRST_ROW + 2)
+
+
+def test_split_oversized_group():
+    # the only first-level group doesn't fit on a sheet
+    sheet_dict = {"S": {"A": {f"g{i}": {"m": [i, i]} for i in range(6)}}}
+    plan = layout_sheet(sheet_dict, FIRST_ROW, 2)
+    parts = split_plan(plan, "S", FIRST_ROW + 8)
+    assert len(parts) > 1
+    assert all(data_rows(part) for part in parts)
+    # continuation parts start at a group
+    assert all(part.labels[1].startswith("g") for part in parts[1:])
+
+
+def test_split_blank_rows():
+    parts = split_plan(layout_sheet(SPLIT_GROUP, FIRST_ROW, 2), "S", FIRST_ROW + 4)
+    assert [list(part.labels) for part in parts] == [
+        ["-- S --", "A", "m1"],
+        ["-- S (continued) --", "m2", None],
+        ["-- S (continued) --", "x", "m1", None],
+    ]
+
+
+def test_split_random():
+    for plan, max_rows in random_plans(200):
+        parts = split_plan(plan, "S", max_rows)
+        assert all(FIRST_ROW + part.n_rows <= max_rows for part in parts)
+        # every row once, in order, after the continuation titles
+        labels = [parts[0].labels, *(part.labels[1:] for part in parts[1:])]
+        assert list(np.concatenate(labels)) == list(plan.labels)
+        for part in parts[1:]:
+            assert part.styles[1] != STYLE_BLANK
+        # with room for the deepest group and a row of data, no part goes without
+        if max_rows >= FIRST_ROW + 6:
+            assert all(data_rows(part) for part in parts)
@@ -0,0 +1,142 @@
+import http.client
+import re
+import socket
+import threading
+
+import pytest
+
+from excelcreator.server import ConversionServer, ConversionService
+
+CSV = b"""Group,Boundaries,Purpose,Mode,Base 2016,Proj 2031
+Trips,Sydney,Work,Car,1,2
+Trips,Sydney,Work,Bus,4,5
+Trips,Sydney,Other,Car,7,9
+"""
+
+MAX_UPLOAD_BYTES = 1 << 16
+
+# a sample line of the Prometheus text format: name, optional labels, value
+METRIC_LINE = re.compile(r'^[a-z_]+(\{[a-z_]+="[^"]*"\})? [0-9.e+-]+$')
+
+
+@pytest.fixture(scope="module")
+def server():
+    service = ConversionService(1, 0)
+    server = ConversionServer(("127.0.0.1", 0), service, MAX_UPLOAD_BYTES)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+
+def request(server, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response, response.read()
+    finally:
+        conn.close()
+
+
+def test_convert(server):
+    response, body = request(server, "POST", "/convert?name=out.xlsx", CSV)
+    assert response.status == 200
+    assert response.getheader("Content-Type").endswith("spreadsheetml.sheet")
+    assert 'filename="out.xlsx"' in response.getheader("Content-Disposition")
+    assert body[:2] == b"PK"  # xlsx files are zip archives
+    assert int(response.getheader("Content-Length")) == len(body)
+
+
+def test_busy(server):
+    # take the only slot, as a conversion in progress would
+    slots = server.service.slots
+    assert slots.acquire(blocking=False)
+    try:
+        response, _ = request(server, "POST", "/convert", CSV)
+    finally:
+        slots.release()
+    assert response.status == 503
+    assert response.getheader("Retry-After") == "1"
+
+
+def test_too_many_connections(server):
+    busy = ConversionServer(
+        ("127.0.0.1", 0), server.service, MAX_UPLOAD_BYTES, max_connections=1
+    )
+    thread = threading.Thread(target=busy.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # an idle connection takes the only one
+        with socket.create_connection(busy.server_address, timeout=30):
+            response, _ = request(busy, "GET", "/healthz")
+        assert response.status == 503
+        assert response.getheader("Retry-After") == "1"
+    finally:
+        busy.shutdown()
+        busy.server_close()
+
+
+def test_too_large(server):
+    response, _ = request(server, "POST", "/convert", b"x" * (MAX_UPLOAD_BYTES + 1))
+    assert response.status == 413
+
+
+def test_bad_formulas(server):
+    response, _ = request(server, "POST", "/convert?formulas=nope", CSV)
+    assert response.status == 400
+
+
+def test_unread_body_closes_connection(server):
+    # a body left unread mustn't be taken for a second request on the same connection
+    body = b"GET /nope HTTP/1.1\r\nHost: x\r\n\r\n"
+    with socket.create_connection(server.server_address, timeout=30) as sock:
+        sock.sendall(
+            b"POST /convert?formulas=nope HTTP/1.1\r\nHost: x\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        replies = b""
+        while chunk := sock.recv(1 << 16):
+            replies += chunk
+    assert replies.startswith(b"HTTP/1.1 400")
+    assert replies.count(b"HTTP/1.1") == 1
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_bad_content_length(server, length):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=30)
+    try:
+        conn.putrequest("POST", "/convert")
+        conn.putheader("Content-Length", length)
+        conn.endheaders()
+        response = conn.getresponse()
+    finally:
+        conn.close()
+    assert response.status == 400
+
+
+def test_metrics(server):
+    request(server, "POST", "/convert", CSV)
+    response, body = request(server, "GET", "/metrics")
+    assert response.status == 200
+
+    families = {}
+    family = None
+    for line in body.decode().splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, kind = line.split()
+            assert family not in families, f"{family} declared twice"
+            families[family] = kind
+            continue
+        assert METRIC_LINE.match(line), line
+        # every sample belongs to the family declared just above it
+        name = line.split("{")[0].split()[0]
+        assert name in (family, f"{family}_sum", f"{family}_count"), line
+
+    assert families["createxl_latency_seconds"] == "summary"
+    assert families["createxl_queue_wait_seconds"] == "summary"
+    assert 'createxl_requests_total{status="ok"}' in body.decode()
+    assert "createxl_queue_wait_seconds_sum" in body.decode()
@@ -0,0 +1,58 @@
+from excelcreator.sheetnames import (
+    SheetNameResolver,
+    resolve_sheetnames,
+    shorten_sheetname,
+)
+
+LONG = "Average Distance Terminating Population Extra"
+
+
+def test_shorten():
+    assert shorten_sheetname("Trips") == "Trips"
+    assert shorten_sheetname(LONG) == "Avg. Dist. Term. Pop. Extra"
+    assert len(shorten_sheetname("x" * 40)) == 31
+
+
+def test_collisions():
+    names = resolve_sheetnames(["Trips", "trips", "TRIPS", "Trips"])
+    assert names == {"Trips": "Trips", "trips": "trips~2", "TRIPS": "TRIPS~3"}
+
+
+def test_long_collisions():
+    # two names that shorten to the same 31 characters
+    names = resolve_sheetnames(["x" * 40, "x" * 41])
+    assert names == {"x" * 40: "x" * 31, "x" * 41: "x" * 29 + "~2"}
+
+
+def test_index_reserved():
+    names = resolve_sheetnames(["index", "Index"])
+    assert names == {"index": "index~2", "Index": "Index~3"}
+
+
+def test_same_name_resolved_once():
+    resolver = SheetNameResolver()
+    assert resolver("Trips") == resolver("Trips") == "Trips"
+    assert not resolver.changed
+    resolver("trips")
+    assert resolver.changed
+
+
+def test_continuation():
+    resolver = SheetNameResolver(reserved=("Index", "Trips"))
+    assert resolver.continuation("Trips", 2) == "Trips (2)"
+    assert resolver.continuation("Trips", 3) == "Trips (3)"
+
+
+def test_continuation_cut():
+    name = "x" * 31
+    resolver = SheetNameResolver(reserved=("Index", name))
+    assert resolver.continuation(name, 2) == "x" * 27 + " (2)"
+    assert resolver.continuation(name, 10) == "x" * 26 + " (10)"
+
+
+def test_continuation_taken():
+    # another sheet already has the continuation's name: the suffix stays whole
+    name = "x" * 31
+    resolver = SheetNameResolver(reserved=("Index", name, "x" * 27 + " (2)"))
+    assert resolver.continuation(name, 2) == "x" * 25 + "~2 (2)"
+    assert resolver.continuation(name, 2) == "x" * 25 + "~3 (2)"
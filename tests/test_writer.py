@@ -0,0 +1,67 @@
+import io
+import zipfile
+
+import pandas as pd
+import xlsxwriter
+
+from excelcreator import to_xlsx_bytes
+from excelcreator.cache import SheetCache
+from excelcreator.writer import create_format_dict, write_index_entries
+
+CSV = """Group,Boundaries,Purpose,Mode,Base 2016,Proj 2031
+Trips,Sydney,Work,Car,1,2
+Trips,Sydney,Work,Bus,4,5
+"""
+
+
+def workbook_xml(**options) -> str:
+    xlsx = to_xlsx_bytes(pd.read_csv(io.StringIO(CSV)), **options)
+    with zipfile.ZipFile(io.BytesIO(xlsx)) as archive:
+        return archive.read("xl/workbook.xml").decode()
+
+
+def test_no_full_calc_on_load():
+    # formulas are written with their results, Excel needn't recalculate on load
+    xml = workbook_xml()
+    assert 'calcId="191029"' in xml
+    assert "fullCalcOnLoad" not in xml
+
+
+def workbook_parts(**options) -> dict[str, bytes]:
+    xlsx = to_xlsx_bytes(pd.read_csv(io.StringIO(CSV)), **options)
+    with zipfile.ZipFile(io.BytesIO(xlsx)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_workers_write_the_same_workbook():
+    # sheets written by the process pool are those the main process writes itself
+    serial = workbook_parts(streaming=True, subtotals="formulas")
+    pooled = workbook_parts(streaming=True, subtotals="formulas", workers=2)
+    assert serial.keys() == pooled.keys()
+    for name in serial:
+        if name != "docProps/core.xml":
+            assert pooled[name] == serial[name], name
+
+
+def test_cache_reuses_sheet_xml(tmp_path):
+    cache = SheetCache(str(tmp_path))
+    first = workbook_parts(cache=cache)
+    (part_path,) = tmp_path.glob("*.xml")
+    assert part_path.read_bytes() == first["xl/worksheets/sheet2.xml"]
+    # a rerun copies the cached sheet in rather than writing it again
+    part_path.write_bytes(part_path.read_bytes().replace(b"Sydney", b"Cached"))
+    second = workbook_parts(cache=cache)
+    assert b"Cached" in second["xl/worksheets/sheet2.xml"]
+
+
+def test_hyperlink_formula_cached_name():
+    # an Index entry past the hyperlink limit shows at most 255 characters of its name
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    index_sheet = workbook.add_worksheet("Index")
+    entries = [("x" * 300, "'S'!A1", "index_header")]
+    write_index_entries(index_sheet, entries, create_format_dict(workbook, 1), 0, False)
+    workbook.close()
+    with zipfile.ZipFile(output) as archive:
+        index_xml = archive.read("xl/worksheets/sheet1.xml").decode()
+    assert f'"{"x" * 255}")</f><v>{"x" * 255}</v>' in index_xml